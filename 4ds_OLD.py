@@ -1,10 +1,21 @@
 from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import io
 import os
+import json
+import math
+import hashlib
+import mmap
 import bpy # type: ignore
 import bmesh # type: ignore
 import struct
-from mathutils import Quaternion, Matrix, Vector # type: ignore
+import numpy as np
+from mathutils import Euler, Quaternion, Matrix, Vector # type: ignore
+from mathutils.bvhtree import BVHTree # type: ignore
 from bpy_extras.io_utils import ImportHelper, ExportHelper # type: ignore
+from bpy_extras.anim_utils import action_get_channelbag_for_slot # type: ignore
 from bpy.props import StringProperty, EnumProperty, IntProperty, FloatProperty, FloatVectorProperty, BoolProperty # type: ignore
 bl_info = {
     "name": "LS3D 4DS Importer/Exporter",
@@ -159,6 +170,7 @@ class The4DSPanel(bpy.types.Panel):
             box = layout.box()
             box.label(text="Level-Of-Detail Settings", icon='MESH_DATA')
             box.prop(obj, "ls3d_lod_dist")
+            box.operator(LS3D_OT_ComputeLODDistances.bl_idname, icon='DRIVER_DISTANCE')
 
         # --- SPECIFIC TYPES ---
         if "plane" in obj.name.lower() or "portal" in obj.name.lower():
@@ -176,6 +188,14 @@ class The4DSPanel(bpy.types.Panel):
             box.prop(obj, "ls3d_sector_flags1")
             box.prop(obj, "ls3d_sector_flags2")
 
+        if obj.type == 'MESH':
+            box = layout.box()
+            box.label(text="Sectors & Portals", icon='MOD_BUILD')
+            box.operator(LS3D_OT_GenerateSectors.bl_idname)
+            box.operator(LS3D_OT_AssignSectors.bl_idname)
+            box.operator(LS3D_OT_AnalyzePVS.bl_idname)
+            box.operator(LS3D_OT_GenerateOccluders.bl_idname)
+
         if obj.type == 'MESH' and hasattr(obj, "visual_type") and obj.visual_type == '4':
             box = layout.box()
             box.label(text="Billboard", icon='IMAGE_PLANE')
@@ -423,10 +443,1205 @@ class LS3D_OT_AddNode(bpy.types.Operator):
         
         return {'FINISHED'}
 
+class LS3D_OT_ComputeLODDistances(bpy.types.Operator):
+    """Compute LOD fade-in distances of every LOD chain in the scene from its geometric error"""
+    bl_idname = "object.ls3d_compute_lod_distances"
+    bl_label = "Compute LOD Distances"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    pixel_error: FloatProperty(name="Pixel Error", default=1.0, min=0.01, description="Screen-space error (pixels) allowed when a LOD fades in")
+    fov: FloatProperty(name="Field of View", default=math.radians(60.0), min=math.radians(1.0), max=math.radians(170.0), subtype='ANGLE', description="Vertical camera field of view")
+    screen_height: IntProperty(name="Screen Height", default=600, min=1, description="Vertical resolution in pixels")
+
+    def execute(self, context):
+        scene_objects = {o.name: o for o in context.scene.objects}
+        chains = 0
+        for obj in context.scene.objects:
+            if obj.type != 'MESH' or "_lod" in obj.name:
+                continue
+            lods = [obj]
+            for i in range(1, 10):
+                lod_obj = scene_objects.get(f"{obj.name}_lod{i}")
+                if lod_obj and lod_obj.type == 'MESH':
+                    lods.append(lod_obj)
+            if len(lods) < 2:
+                continue
+
+            levels = []
+            for lod_obj in lods:
+                mesh = lod_obj.data
+                mesh.calc_loop_triangles()
+                co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+                mesh.vertices.foreach_get("co", co)
+                tris = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+                mesh.loop_triangles.foreach_get("vertices", tris)
+                levels.append((co.reshape(-1, 3).astype(np.float64), tris.reshape(-1, 3)))
+
+            scale = max(obj.matrix_world.to_scale())
+            for lod_obj, dist in zip(lods[1:], lod_chain_distances(levels, scale, self.pixel_error, self.fov, self.screen_height)):
+                lod_obj.ls3d_lod_dist = dist
+            chains += 1
+
+        self.report({'INFO'}, f"Updated fade distances of {chains} LOD chains")
+        return {'FINISHED'}
+
+class LS3D_OT_GenerateSectors(bpy.types.Operator):
+    """Generate sector hulls and portals from room volumes or a grid decomposition of an interior mesh.
+    Room volumes are hidden and left out of later exports. Grid cells only create sectors, the
+    interior mesh itself is not split per sector"""
+    bl_idname = "object.ls3d_generate_sectors"
+    bl_label = "Generate Sectors & Portals"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    mode: EnumProperty(
+        name="Source",
+        items=(
+            ('VOLUMES', "Room Volumes", "Every selected closed mesh is one room"),
+            ('CELLS', "Grid Cells", "Split the active interior mesh into grid cells"),
+        ),
+        default='VOLUMES'
+    )
+    cell_size: FloatProperty(name="Cell Size", default=10.0, min=0.1, description="Edge length of a grid cell")
+    tolerance: FloatProperty(name="Contact Tolerance", default=0.05, min=0.0, description="Gap up to which two volumes count as touching")
+    min_portal_area: FloatProperty(name="Min Portal Area", default=0.5, min=0.0, description="Smaller openings get no portal")
+    reparent: BoolProperty(name="Reparent Objects", default=True, description="Move root visual objects into the sector that contains them")
+
+    @classmethod
+    def poll(cls, context):
+        return context.active_object is not None and context.active_object.type == 'MESH'
+
+    def world_geometry(self, obj):
+        mesh = obj.data
+        mesh.calc_loop_triangles()
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get("co", co)
+        tris = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get("vertices", tris)
+        matrix = np.array(obj.matrix_world, dtype=np.float64)
+        co = co.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+        return co, tris.reshape(-1, 3)
+
+    def new_mesh_object(self, context, name, points, hull):
+        """Mesh object at the world origin; hull=True wraps the points in a triangulated convex hull."""
+        mesh = bpy.data.meshes.new(name)
+        bm = bmesh.new()
+        try:
+            verts = [bm.verts.new(p) for p in points]
+            if hull:
+                result = bmesh.ops.convex_hull(bm, input=verts)
+                unused = [v for v in result['geom_interior'] + result['geom_unused'] if isinstance(v, bmesh.types.BMVert)]
+                bmesh.ops.delete(bm, geom=unused, context='VERTS')
+                bmesh.ops.triangulate(bm, faces=bm.faces[:])
+            else:
+                bm.faces.new(verts)
+            bm.to_mesh(mesh)
+        finally:
+            bm.free()
+        obj = bpy.data.objects.new(name, mesh)
+        context.collection.objects.link(obj)
+        return obj
+
+    def execute(self, context):
+        if self.mode == 'VOLUMES':
+            volumes = [o for o in context.selected_objects if o.type == 'MESH' and "sector" not in o.name.lower() and len(o.data.vertices) >= 4]
+            hulls = [self.world_geometry(o)[0] for o in volumes]
+            if not hulls:
+                self.report({'ERROR'}, "Select the closed room volumes")
+                return {'CANCELLED'}
+            box_min = np.array([co.min(axis=0) for co in hulls])
+            box_max = np.array([co.max(axis=0) for co in hulls])
+        else:
+            volumes = [context.active_object]
+            co, tris = self.world_geometry(context.active_object)
+            if not len(tris):
+                self.report({'ERROR'}, "The active mesh has no faces")
+                return {'CANCELLED'}
+            box_min, box_max = grid_cell_boxes(surface_samples(co, tris, max_samples=200000), self.cell_size)
+            corners = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=np.float64)
+            hulls = [lo + corners * (hi - lo) for lo, hi in zip(box_min, box_max)]
+
+        if self.mode == 'VOLUMES':
+            # The volumes only describe the rooms, they must not be exported as visual frames
+            for volume in volumes:
+                volume["ls3d_no_export"] = True
+                volume.hide_render = True
+                volume.hide_set(True)
+
+        sectors = []
+        for i, points in enumerate(hulls):
+            sector = self.new_mesh_object(context, f"sector_{i:02d}", points, hull=True)
+            sector.bbox_min = box_min[i]
+            sector.bbox_max = box_max[i]
+            sectors.append(sector)
+
+        # Every opening gets a portal on both sides, its normal facing into the owning sector
+        portal_counts = [0] * len(sectors)
+        openings = box_portals(box_min, box_max, self.tolerance, self.min_portal_area)
+        for i, j, quad in openings:
+            for owner, points in ((i, quad[::-1]), (j, quad)):
+                sector = sectors[owner]
+                portal = self.new_mesh_object(context, f"{sector.name}_portal_{portal_counts[owner]}", points, hull=False)
+                portal.parent = sector
+                portal_counts[owner] += 1
+
+        orphans = 0
+        if self.reparent:
+            generated = set(sectors) | set(volumes)
+            movable = [o for o in context.scene.objects
+                       if o.parent is None and o not in generated and o.type in ('MESH', 'EMPTY') and not o.get("ls3d_no_export")
+                       and "sector" not in o.name.lower() and o.display_type != 'WIRE']
+            if movable:
+                context.view_layer.update()
+                centers = np.array([o.matrix_world.translation for o in movable], dtype=np.float64)
+                owners = SectorClassifier(sectors).classify(centers)
+                for obj, owner in zip(movable, owners):
+                    if owner < 0:
+                        orphans += 1
+                        continue
+                    world = obj.matrix_world.copy()
+                    obj.parent = sectors[owner]
+                    obj.matrix_world = world
+
+        self.report({'INFO'}, f"Generated {len(sectors)} sectors, {len(openings)} openings ({2 * len(openings)} portals)"
+                              + (f", {orphans} objects outside every sector" if orphans else ""))
+        return {'FINISHED'}
+
+class LS3D_OT_AnalyzePVS(bpy.types.Operator):
+    """Compute the potentially visible sectors of every sector and suggest portal ranges"""
+    bl_idname = "object.ls3d_analyze_pvs"
+    bl_label = "Analyze Portal Visibility"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    min_pixels: FloatProperty(name="Min Pixels", default=4.0, min=0.01, description="A sector smaller than this on screen is not worth drawing (suggested far range)")
+    fov: FloatProperty(name="Field of View", default=math.radians(60.0), min=math.radians(1.0), max=math.radians(170.0), subtype='ANGLE', description="Vertical camera field of view")
+    screen_height: IntProperty(name="Screen Height", default=600, min=1, description="Vertical resolution in pixels")
+    apply_suggestions: BoolProperty(name="Apply Suggestions", default=False, description="Write the suggested near/far ranges to the portals")
+
+    def world_points(self, obj):
+        co = np.empty(len(obj.data.vertices) * 3, dtype=np.float64)
+        obj.data.vertices.foreach_get("co", co)
+        matrix = np.array(obj.matrix_world, dtype=np.float64)
+        return co.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+
+    def execute(self, context):
+        sectors = [o for o in context.scene.objects
+                   if o.type == 'MESH' and "sector" in o.name.lower() and not is_portal(o) and len(o.data.vertices)]
+        if not sectors:
+            self.report({'ERROR'}, "The scene has no sectors")
+            return {'CANCELLED'}
+        sector_index = {s: i for i, s in enumerate(sectors)}
+        points = [self.world_points(s) for s in sectors]
+        box_min = np.array([p.min(axis=0) for p in points])
+        box_max = np.array([p.max(axis=0) for p in points])
+
+        # Triangles drawn with each sector: its visual descendants (not nested in another sector)
+        sector_tris = [0] * len(sectors)
+        global_tris = 0
+        for obj in context.scene.objects:
+            if obj.type != 'MESH' or obj in sector_index or is_portal(obj) or obj.display_type == 'WIRE' or "_lod" in obj.name:
+                continue
+            owner = obj.parent
+            while owner is not None and owner not in sector_index:
+                owner = owner.parent
+            num_tris = sum(len(p.vertices) - 2 for p in obj.data.polygons)
+            if owner is None:
+                global_tris += num_tris
+            else:
+                sector_tris[sector_index[owner]] += num_tris
+
+        # Portal graph: a portal leads into the other sector whose bounds contain its centroid
+        portals = []
+        portal_objects = []
+        for sector in sectors:
+            owner = sector_index[sector]
+            for portal in sector.children:
+                if not is_portal(portal) or not portal.ls3d_portal_enabled or len(portal.data.vertices) < 3:
+                    continue
+                centroid = self.world_points(portal).mean(axis=0)
+                inside = ((centroid >= box_min - 1e-3) & (centroid <= box_max + 1e-3)).all(axis=1)
+                inside[owner] = False
+                if not inside.any():
+                    print(f"Portal {portal.name} leads nowhere")
+                    continue
+                target = int(np.flatnonzero(inside)[0])
+                portals.append((owner, target, centroid, portal.ls3d_portal_near, portal.ls3d_portal_far))
+                portal_objects.append(portal)
+
+        total_tris = sum(sector_tris) + global_tris
+        drawn = []
+        print(f"Potentially visible sets ({len(sectors)} sectors, {len(portals)} portals, {total_tris} triangles):")
+        for sector in sectors:
+            start = sector_index[sector]
+            visible = sector_pvs(start, box_min, box_max, portals)
+            tris = global_tris + sum(sector_tris[i] for i in visible)
+            drawn.append(tris)
+            print(f"  {sector.name}: {len(visible)} sectors visible, ~{tris} triangles drawn")
+
+        # Suggested ranges: open until the revealed sector shrinks below min_pixels on screen,
+        # never beyond the farthest spot a viewer in the owning sector can stand
+        suggested = 0
+        for portal, (owner, target, centroid, near, far) in zip(portal_objects, portals):
+            radius = float(np.linalg.norm(box_max[target] - box_min[target])) * 0.5
+            d_min, d_max = box_distance_range(box_min[owner], box_max[owner], centroid)
+            new_far = min(lod_distance_for_error(radius, self.min_pixels, self.fov, self.screen_height), d_max)
+            new_far = max(new_far, d_min)
+            if abs(new_far - far) > 1e-3 or near != 0.0:
+                print(f"  {portal.name}: near {near:.1f} -> 0.0, far {far:.1f} -> {new_far:.1f}")
+                suggested += 1
+                if self.apply_suggestions:
+                    portal.ls3d_portal_near = 0.0
+                    portal.ls3d_portal_far = new_far
+
+        average = sum(drawn) / len(drawn)
+        culled = 100.0 * (1.0 - average / total_tris) if total_tris else 0.0
+        self.report({'INFO'}, f"Average {average:.0f} of {total_tris} triangles drawn per sector ({culled:.0f}% culled), "
+                              f"{suggested} portal ranges {'updated' if self.apply_suggestions else 'could be tightened'} (see console)")
+        return {'FINISHED'}
+
+class LS3D_OT_AssignSectors(bpy.types.Operator):
+    """Reparent visual, dummy and target objects into the sector whose hull contains them"""
+    bl_idname = "object.ls3d_assign_sectors"
+    bl_label = "Assign Objects to Sectors"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    only_selected: BoolProperty(name="Only Selected", default=False, description="Classify only the selected objects")
+
+    def execute(self, context):
+        sectors = [o for o in context.scene.objects
+                   if o.type == 'MESH' and "sector" in o.name.lower() and not is_portal(o) and len(o.data.polygons)]
+        if not sectors:
+            self.report({'ERROR'}, "The scene has no sectors")
+            return {'CANCELLED'}
+        sector_set = set(sectors)
+
+        # Only the top of every hierarchy inside a sector moves, children follow their parent
+        source = context.selected_objects if self.only_selected else context.scene.objects
+        movable = []
+        for obj in source:
+            if obj in sector_set or obj.get("ls3d_no_export") or (obj.parent is not None and obj.parent not in sector_set):
+                continue
+            if obj.type == 'MESH':
+                if "sector" in obj.name.lower() or obj.display_type == 'WIRE' or "_lod" in obj.name:
+                    continue
+            elif not (obj.type == 'EMPTY' and obj.empty_display_type in ('CUBE', 'PLAIN_AXES')):
+                continue
+            movable.append(obj)
+        if not movable:
+            self.report({'INFO'}, "Nothing to classify")
+            return {'FINISHED'}
+
+        # Meshes are placed by their bounds center, empties by their origin
+        points = np.empty((len(movable), 3), dtype=np.float64)
+        for i, obj in enumerate(movable):
+            if obj.type == 'MESH':
+                corners = np.array(obj.bound_box, dtype=np.float64)
+                matrix = np.array(obj.matrix_world, dtype=np.float64)
+                points[i] = corners.mean(axis=0) @ matrix[:3, :3].T + matrix[:3, 3]
+            else:
+                points[i] = obj.matrix_world.translation
+
+        owners = SectorClassifier(sectors).classify(points)
+        moved = 0
+        orphans = []
+        for obj, owner in zip(movable, owners):
+            if owner < 0:
+                orphans.append(obj.name)
+                continue
+            if obj.parent is not sectors[owner]:
+                world = obj.matrix_world.copy()
+                obj.parent = sectors[owner]
+                obj.matrix_world = world
+                moved += 1
+
+        if orphans:
+            print(f"Objects outside every sector: {', '.join(sorted(orphans))}")
+        self.report({'INFO'}, f"Classified {len(movable)} objects into {len(sectors)} sectors: {moved} reparented, {len(orphans)} orphans"
+                              + (" (see console)" if orphans else ""))
+        return {'FINISHED'}
+
+class LS3D_OT_GenerateOccluders(bpy.types.Operator):
+    """Fit conservative occluder boxes inside the selected closed meshes"""
+    bl_idname = "object.ls3d_generate_occluders"
+    bl_label = "Generate Occluders"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    resolution: IntProperty(name="Resolution", default=24, min=4, max=128, description="Voxels along the longest side of a mesh")
+    max_boxes: IntProperty(name="Max Boxes", default=3, min=1, max=16, description="Occluder boxes per mesh at most")
+    view_distance: FloatProperty(name="View Distance", default=50.0, min=0.1, description="Typical camera distance for the coverage score")
+    min_score: FloatProperty(name="Min Pixels per Triangle", default=50.0, min=0.0, description="Occluders covering less screen area per triangle are dropped")
+    fov: FloatProperty(name="Field of View", default=math.radians(60.0), min=math.radians(1.0), max=math.radians(170.0), subtype='ANGLE', description="Vertical camera field of view")
+    screen_height: IntProperty(name="Screen Height", default=600, min=1, description="Vertical resolution in pixels")
+
+    def solid_voxels(self, obj):
+        """Voxels of the mesh interior (local space): column rays along Z, crossings paired up."""
+        mesh = obj.data
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get("co", co)
+        co = co.reshape(-1, 3)
+        tree = BVHTree.FromPolygons(list(map(tuple, co)), [p.vertices[:] for p in mesh.polygons])
+        lo, hi = co.min(axis=0), co.max(axis=0)
+        cell = max(float((hi - lo).max()) / self.resolution, 1e-6)
+        dims = np.maximum(np.ceil((hi - lo) / cell).astype(np.int64), 1)
+        solid = np.zeros(dims, dtype=bool)
+        up = Vector((1e-4, 2e-4, 1.0)).normalized()
+        for x in range(dims[0]):
+            for y in range(dims[1]):
+                origin = Vector((lo[0] + (x + 0.5) * cell, lo[1] + (y + 0.5) * cell, lo[2] - cell))
+                hits = []
+                while len(hits) < 64:
+                    location = tree.ray_cast(origin, up)[0]
+                    if location is None:
+                        break
+                    hits.append(location.z)
+                    origin = location + up * 1e-5
+                if len(hits) % 2:
+                    continue  # open or touching surface, not trustworthy
+                centers = lo[2] + (np.arange(dims[2]) + 0.5) * cell
+                for enter, leave in zip(hits[::2], hits[1::2]):
+                    # Whole voxel between the crossings, not only its center
+                    solid[x, y] |= (centers - cell * 0.5 >= enter) & (centers + cell * 0.5 <= leave)
+        return solid, lo, cell
+
+    def execute(self, context):
+        sources = [o for o in context.selected_objects
+                   if o.type == 'MESH' and o.display_type != 'WIRE' and "sector" not in o.name.lower() and len(o.data.polygons)]
+        if not sources:
+            self.report({'ERROR'}, "Select the meshes to generate occluders for")
+            return {'CANCELLED'}
+
+        created = dropped = 0
+        for src in sources:
+            solid, origin, cell = self.solid_voxels(src)
+            scale = np.array(src.matrix_world.to_scale(), dtype=np.float64)
+            for index, (lo, hi) in enumerate(inner_boxes(solid, self.max_boxes)):
+                box_lo = origin + np.array(lo) * cell
+                box_hi = origin + np.array(hi) * cell
+                score = box_coverage_pixels((box_hi - box_lo) * np.abs(scale), self.view_distance, self.fov, self.screen_height) / BOX_TRIANGLES
+                if score < self.min_score:
+                    dropped += 1
+                    continue
+                name = f"{src.name}_occluder{index}"
+                mesh = bpy.data.meshes.new(name)
+                bm = bmesh.new()
+                try:
+                    bmesh.ops.create_cube(bm, size=1.0)
+                    for v in bm.verts:
+                        v.co = Vector(box_lo + (np.array(v.co) + 0.5) * (box_hi - box_lo))
+                    bmesh.ops.triangulate(bm, faces=bm.faces[:])
+                    bm.to_mesh(mesh)
+                finally:
+                    bm.free()
+                occluder = bpy.data.objects.new(name, mesh)
+                context.collection.objects.link(occluder)
+                occluder.display_type = 'WIRE'  # exported as FRAME_OCCLUDER
+                occluder.parent = src.parent
+                occluder.matrix_world = src.matrix_world.copy()
+                created += 1
+
+        self.report({'INFO'}, f"Created {created} occluders for {len(sources)} meshes"
+                              + (f", dropped {dropped} below {self.min_score:.0f} pixels per triangle" if dropped else ""))
+        return {'FINISHED'}
+
+def estimate_mesh_bytes(mesh):
+    """Rough size of the arrays Blender allocates for a mesh (positions, edges, corners, faces, UVs)."""
+    num_loops = len(mesh.loops)
+    return (
+        len(mesh.vertices) * 12
+        + len(mesh.edges) * 8
+        + num_loops * (8 + 12 + 8 * len(mesh.uv_layers))
+        + len(mesh.polygons) * 12
+    )
+
+# The format stores vertex counts, triangle counts and indices as 16-bit values
+MAX_VERTICES = 65535
+MAX_GROUP_TRIANGLES = 65535
+# Per-frame detail lines shown in the export report before they are cut off
+REPORT_LIST_LIMIT = 20
+
+class ExportError(Exception):
+    """The scene cannot be written as a valid .4ds (reported to the user, nothing is written)."""
+
+# --- LOD DISTANCES ---
+def lod_distance_for_error(error, pixel_error, fov, screen_height):
+    """Distance at which a geometric error (world units) projects to pixel_error pixels on screen."""
+    return error * screen_height / (2.0 * math.tan(fov / 2.0) * max(pixel_error, 1e-6))
+
+def tessellation_error(radius, num_tris):
+    """Chordal error of a sphere of the given radius tessellated into num_tris triangles."""
+    # Edge length e from the triangle area 4*pi*r^2 / n, sagitta e^2 / 8r
+    return 2.0 * math.pi * radius / (math.sqrt(3.0) * max(num_tris, 1))
+
+def point_triangle_distances(points, a, b, c):
+    """Distance from every point (N,3) to the nearest of the triangles a/b/c (M,3 each).
+
+    Vectorized closest-point-on-triangle test (Ericson, Real-Time Collision Detection 5.1.5),
+    evaluated in point chunks so memory stays bounded.
+    """
+    result = np.full(len(points), np.inf)
+    if not len(a):
+        return result
+    # Degenerate triangles (zero area) are measured as their three edges instead
+    degenerate = np.linalg.norm(np.cross(b - a, c - a), axis=1) < 1e-12
+    if degenerate.any():
+        da, db, dc = a[degenerate], b[degenerate], c[degenerate]
+        seg_a = np.concatenate((da, db, da))
+        seg_d = np.concatenate((db - da, dc - db, dc - da))
+        seg_len = np.maximum((seg_d * seg_d).sum(-1), 1e-30)
+        chunk = max(1, 250000 // len(seg_a))
+        for start in range(0, len(points), chunk):
+            p = points[start:start + chunk, None, :]
+            t = np.clip(((p - seg_a) * seg_d).sum(-1) / seg_len, 0.0, 1.0)
+            dist = np.linalg.norm(p - (seg_a + seg_d * t[..., None]), axis=-1).min(axis=1)
+            result[start:start + chunk] = np.minimum(result[start:start + chunk], dist)
+        a, b, c = a[~degenerate], b[~degenerate], c[~degenerate]
+        if not len(a):
+            return result
+
+    ab, ac, bc = b - a, c - a, c - b
+    chunk = max(1, 250000 // len(a))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, len(points), chunk):
+            p = points[start:start + chunk, None, :]
+            ap, bp, cp = p - a, p - b, p - c
+            d1, d2 = (ab * ap).sum(-1), (ac * ap).sum(-1)
+            d3, d4 = (ab * bp).sum(-1), (ac * bp).sum(-1)
+            d5, d6 = (ab * cp).sum(-1), (ac * cp).sum(-1)
+            va, vb, vc = d3 * d6 - d5 * d4, d5 * d2 - d1 * d6, d1 * d4 - d3 * d2
+
+            # Face interior first, then regions in reverse priority so the first match wins
+            denom = va + vb + vc
+            closest = a + ab * (vb / denom)[..., None] + ac * (vc / denom)[..., None]
+            t = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+            closest = np.where(((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0))[..., None], b + bc * t[..., None], closest)
+            t = d2 / (d2 - d6)
+            closest = np.where(((vb <= 0) & (d2 >= 0) & (d6 <= 0))[..., None], a + ac * t[..., None], closest)
+            closest = np.where(((d6 >= 0) & (d5 <= d6))[..., None], np.broadcast_to(c, closest.shape), closest)
+            t = d1 / (d1 - d3)
+            closest = np.where(((vc <= 0) & (d1 >= 0) & (d3 <= 0))[..., None], a + ab * t[..., None], closest)
+            closest = np.where(((d3 >= 0) & (d4 <= d3))[..., None], np.broadcast_to(b, closest.shape), closest)
+            closest = np.where(((d1 <= 0) & (d2 <= 0))[..., None], np.broadcast_to(a, closest.shape), closest)
+
+            dist = np.linalg.norm(p - closest, axis=-1)
+            result[start:start + chunk] = np.minimum(result[start:start + chunk], np.nan_to_num(dist, nan=np.inf).min(axis=1))
+    return result
+
+def surface_samples(co, tris, max_samples=4000):
+    """Triangle vertices plus centroids (loose vertices ignored), thinned to at most max_samples points."""
+    points = np.concatenate((co[np.unique(tris)], co[tris].mean(axis=1)))
+    if len(points) > max_samples:
+        points = points[np.linspace(0, len(points) - 1, max_samples).astype(np.int64)]
+    return points
+
+def lod_chain_errors(levels):
+    """Geometric error of every LOD relative to LOD0 (symmetric Hausdorff estimate).
+
+    levels: list of (co (N,3), tris (M,3) vertex indices) in the same space. LOD0 gets 0.
+    """
+    base_co, base_tris = levels[0]
+    errors = [0.0]
+    for co, tris in levels[1:]:
+        if not len(tris) or not len(base_tris):
+            errors.append(0.0)
+            continue
+        to_base = point_triangle_distances(surface_samples(co, tris), *(base_co[base_tris[:, i]] for i in range(3)))
+        from_base = point_triangle_distances(surface_samples(base_co, base_tris), *(co[tris[:, i]] for i in range(3)))
+        errors.append(float(max(to_base.max(), from_base.max())))
+    return errors
+
+def lod_chain_distances(levels, scale, pixel_error, fov, screen_height):
+    """Fade-in distances for LOD1..n from their error; never closer than the previous level."""
+    distances = []
+    previous = 0.0
+    for error in lod_chain_errors(levels)[1:]:
+        previous = max(previous, lod_distance_for_error(error * scale, pixel_error, fov, screen_height))
+        distances.append(previous)
+    return distances
+
+# --- SECTORS & PORTALS ---
+def is_portal(obj):
+    """Portals are written inside their parent sector, never as frames of their own."""
+    name = obj.name.lower()
+    return (obj.type == "MESH" and obj.parent is not None and "sector" in obj.parent.name.lower()
+            and ("portal" in name or "plane" in name))
+
+def newell_normal(points):
+    """Unit normal of a (possibly non-planar) polygon (N,3) by Newell's method, zero if degenerate."""
+    points = np.asarray(points, dtype=np.float64)
+    nxt = np.roll(points, -1, axis=0)
+    normal = np.array([
+        ((points[:, 1] - nxt[:, 1]) * (points[:, 2] + nxt[:, 2])).sum(),
+        ((points[:, 2] - nxt[:, 2]) * (points[:, 0] + nxt[:, 0])).sum(),
+        ((points[:, 0] - nxt[:, 0]) * (points[:, 1] + nxt[:, 1])).sum(),
+    ])
+    length = np.linalg.norm(normal)
+    return normal / length if length > 1e-12 else np.zeros(3)
+
+def box_portals(box_min, box_max, tolerance, min_area):
+    """Openings between touching boxes (K,3 min/max arrays).
+
+    Returns (i, j, quad) per touching pair, quad (4,3) lying on the contact plane and
+    wound so its Newell normal points from box i into box j.
+    """
+    portals = []
+    centers = (box_min + box_max) * 0.5
+    for i in range(len(box_min) - 1):
+        lo = np.maximum(box_min[i], box_min[i + 1:])
+        hi = np.minimum(box_max[i], box_max[i + 1:])
+        thickness = hi - lo
+        for k in np.flatnonzero((thickness >= -tolerance).all(axis=1)):
+            axis = int(np.argmin(thickness[k]))
+            if thickness[k, axis] > tolerance:
+                continue  # overlapping volumes, not touching ones
+            a, b = (axis + 1) % 3, (axis + 2) % 3
+            if thickness[k, a] * thickness[k, b] < min_area:
+                continue
+            j = i + 1 + int(k)
+            quad = np.empty((4, 3))
+            quad[:, axis] = (lo[k, axis] + hi[k, axis]) * 0.5
+            quad[:, a] = (lo[k, a], hi[k, a], hi[k, a], lo[k, a])
+            quad[:, b] = (lo[k, b], lo[k, b], hi[k, b], hi[k, b])
+            if centers[j, axis] < centers[i, axis]:
+                quad = quad[::-1]
+            portals.append((i, j, quad))
+    return portals
+
+def grid_cell_boxes(points, cell_size):
+    """Boxes of the grid cells containing any of the points, runs along X merged into one box."""
+    origin = points.min(axis=0)
+    cells = np.unique(np.floor((points - origin) / cell_size).astype(np.int64), axis=0)
+    boxes = []
+    start = prev = None
+    for cell in sorted(map(tuple, cells), key=lambda c: (c[2], c[1], c[0])):
+        if prev is not None and cell[1:] == prev[1:] and cell[0] == prev[0] + 1:
+            prev = cell
+            continue
+        if start is not None:
+            boxes.append((start, prev))
+        start = prev = cell
+    if start is not None:
+        boxes.append((start, prev))
+    box_min = np.array([origin + np.array(s) * cell_size for s, _ in boxes])
+    box_max = np.array([origin + (np.array(e) + 1) * cell_size for _, e in boxes])
+    return box_min, box_max
+
+def box_distance_range(box_min, box_max, point):
+    """Closest and farthest distance from any point of the box to the given point."""
+    nearest = np.clip(point, box_min, box_max)
+    farthest = np.where(np.abs(point - box_min) > np.abs(point - box_max), box_min, box_max)
+    return float(np.linalg.norm(point - nearest)), float(np.linalg.norm(point - farthest))
+
+def sector_pvs(start, box_min, box_max, portals):
+    """Sectors visible from anywhere inside sector start (breadth-first through portals).
+
+    portals: (owner, target, centroid, near, far) tuples. A portal is passable when a viewer in the
+    start sector can stand between its near and far range.
+    """
+    by_owner = {}
+    for portal in portals:
+        by_owner.setdefault(portal[0], []).append(portal)
+    visible = {start}
+    queue = deque([start])
+    while queue:
+        sector = queue.popleft()
+        for _, target, centroid, near, far in by_owner.get(sector, ()):
+            if target in visible:
+                continue
+            d_min, d_max = box_distance_range(box_min[start], box_max[start], centroid)
+            if d_min <= far and d_max >= near:
+                visible.add(target)
+                queue.append(target)
+    return visible
+
+class SectorClassifier:
+    """Point-in-sector test against the closed sector hulls, BVHs built once per classifier.
+
+    A point is inside a hull when a ray from it crosses that hull's surface an odd number
+    of times; the smallest containing sector wins (nested sectors). Every hull gets its own
+    tree so faces shared by neighbouring sectors are counted for both.
+    """
+    MAX_CROSSINGS = 64
+
+    def __init__(self, sectors):
+        self.sectors = sectors
+        self.trees = []
+        box_min, box_max = [], []
+        for sector in sectors:
+            mesh = sector.data
+            co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+            mesh.vertices.foreach_get("co", co)
+            matrix = np.array(sector.matrix_world, dtype=np.float64)
+            co = co.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+            self.trees.append(BVHTree.FromPolygons(list(map(tuple, co)), [p.vertices[:] for p in mesh.polygons]))
+            box_min.append(co.min(axis=0) if len(co) else np.full(3, np.inf))
+            box_max.append(co.max(axis=0) if len(co) else np.full(3, -np.inf))
+        self.box_min = np.array(box_min)
+        self.box_max = np.array(box_max)
+        self.volume = np.prod(np.maximum(self.box_max - self.box_min, 0.0), axis=1)
+
+    def classify(self, points):
+        """Index of the sector containing every point (M,3), -1 for orphans."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        owners = np.full(len(points), -1, dtype=np.int64)
+        # Bounds reject most point/sector pairs before any ray is cast
+        candidates = ((points[:, None, :] >= self.box_min[None]) & (points[:, None, :] <= self.box_max[None])).all(axis=2)
+        # Slightly skewed so rays from grid-aligned points do not run along hull edges
+        direction = Vector((1e-3, 2e-3, 1.0)).normalized()
+        for i in np.flatnonzero(candidates.any(axis=1)):
+            inside = []
+            for sector in np.flatnonzero(candidates[i]):
+                origin = Vector(points[i])
+                crossings = 0
+                for _ in range(self.MAX_CROSSINGS):
+                    location = self.trees[sector].ray_cast(origin, direction)[0]
+                    if location is None:
+                        break
+                    crossings += 1
+                    origin = location + direction * 1e-5
+                if crossings % 2:
+                    inside.append(sector)
+            if inside:
+                inside = np.array(inside)
+                owners[i] = inside[np.argmin(self.volume[inside])]
+        return owners
+
+# --- OCCLUDERS ---
+BOX_TRIANGLES = 12
+
+def inner_boxes(solid, max_boxes, min_cells=8):
+    """Greedy axis-aligned boxes of solid voxels (bool grid), deepest voxel first.
+
+    Every box only contains solid voxels. Returns (lo, hi) index pairs, hi exclusive.
+    """
+    # Depth of every voxel (steps to the nearest empty one) picks the seeds
+    depth = np.zeros(solid.shape, dtype=np.int32)
+    layer = solid.copy()
+    while layer.any():
+        depth += layer
+        padded = np.pad(layer, 1)
+        layer = layer & padded[:-2, 1:-1, 1:-1] & padded[2:, 1:-1, 1:-1] & padded[1:-1, :-2, 1:-1] \
+            & padded[1:-1, 2:, 1:-1] & padded[1:-1, 1:-1, :-2] & padded[1:-1, 1:-1, 2:]
+    # Summed volume table: any sub-box is tested for fullness in O(1)
+    table = np.zeros(tuple(s + 1 for s in solid.shape), dtype=np.int64)
+    table[1:, 1:, 1:] = solid.cumsum(0).cumsum(1).cumsum(2)
+
+    def filled(lo, hi):
+        (x0, y0, z0), (x1, y1, z1) = lo, hi
+        total = (table[x1, y1, z1] - table[x0, y1, z1] - table[x1, y0, z1] - table[x1, y1, z0]
+                 + table[x0, y0, z1] + table[x0, y1, z0] + table[x1, y0, z0] - table[x0, y0, z0])
+        return total == (x1 - x0) * (y1 - y0) * (z1 - z0)
+
+    boxes = []
+    uncovered = solid.copy()
+    while len(boxes) < max_boxes and uncovered.any():
+        seed = np.unravel_index(np.argmax(np.where(uncovered, depth, 0)), solid.shape)
+        lo, hi = [int(s) for s in seed], [int(s) + 1 for s in seed]
+        grown = True
+        while grown:
+            grown = False
+            for axis in range(3):
+                if hi[axis] < solid.shape[axis]:
+                    hi[axis] += 1
+                    if filled(lo, hi): grown = True
+                    else: hi[axis] -= 1
+                if lo[axis] > 0:
+                    lo[axis] -= 1
+                    if filled(lo, hi): grown = True
+                    else: lo[axis] += 1
+        uncovered[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]] = False
+        if np.prod(np.subtract(hi, lo)) < min_cells:
+            uncovered[seed] = False
+            continue
+        boxes.append((tuple(lo), tuple(hi)))
+    return boxes
+
+def box_coverage_pixels(size, view_distance, fov, screen_height):
+    """Average screen area (pixels) of a box seen from view_distance (mean projection = surface / 4)."""
+    sx, sy, sz = size
+    projected = (sx * sy + sy * sz + sz * sx) * 0.5
+    pixels_per_unit = screen_height / (2.0 * math.tan(fov / 2.0) * max(view_distance, 1e-6))
+    return projected * pixels_per_unit * pixels_per_unit
+
+# --- ANIMATION ---
+ANIM_ROTATION = 0x2
+ANIM_POSITION = 0x4
+ANIM_SCALE = 0x8
+# Keyframe.interpolation enum values as returned by foreach_get
+KEY_CONSTANT = 0
+KEY_LINEAR = 1
+
+def filetime_now():
+    """Current time as a Windows FILETIME (100 ns ticks since 1601), as stored in file headers."""
+    return int((datetime.now() - datetime(1601, 1, 1)).total_seconds() * 1e7)
+
+def linear_key_errors(start, end, samples, t):
+    """Distance of the samples from the straight line between two kept keys."""
+    return np.linalg.norm(samples - (start + (end - start) * t[:, None]), axis=1)
+
+def rotation_key_errors(start, end, samples, t):
+    """Angle between the samples and the normalized blend of two kept quaternion keys."""
+    blend = start * (1.0 - t[:, None]) + end * t[:, None]
+    blend /= np.maximum(np.linalg.norm(blend, axis=1, keepdims=True), 1e-12)
+    return 2.0 * np.arccos(np.clip(np.abs((blend * samples).sum(axis=1)), 0.0, 1.0))
+
+def reduce_keys(values, tolerance, key_errors):
+    """Indices of the samples to keep so that interpolating between them stays within
+    tolerance (Ramer-Douglas-Peucker over time). A constant channel keeps one key."""
+    count = len(values)
+    if not count:
+        return []
+    if key_errors(values[0], values[0], values, np.zeros(count)).max() <= tolerance:
+        return [0]
+    if count == 2:
+        return [0, 1]
+    keep = {0, count - 1}
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        t = np.arange(1, last - first) / (last - first)
+        errors = key_errors(values[first], values[last], values[first + 1:last], t)
+        worst = int(np.argmax(errors))
+        if errors[worst] > tolerance:
+            split = first + 1 + worst
+            keep.add(split)
+            stack.extend(((first, split), (split, last)))
+    return sorted(keep)
+
+# --- BOUNDS ---
+def bounding_sphere(points):
+    """Center (box center) and radius enclosing all points (N,3)."""
+    if not len(points):
+        return np.zeros(3), 0.0
+    center = (points.min(axis=0) + points.max(axis=0)) * 0.5
+    return center, float(np.sqrt(((points - center) ** 2).sum(axis=1).max()))
+
+def local_points(obj, others):
+    """Bound box corners of other objects expressed in obj's local space (N,3)."""
+    inverse = np.array(obj.matrix_world.inverted(), dtype=np.float64)
+    points = []
+    for other in others:
+        matrix = inverse @ np.array(other.matrix_world, dtype=np.float64)
+        points.append(np.array(other.bound_box, dtype=np.float64) @ matrix[:3, :3].T + matrix[:3, 3])
+    return np.concatenate(points) if points else np.zeros((0, 3))
+
+# --- TILED EXPORT ---
+def world_bounds(objects):
+    """World-space (min, max) of the bound boxes of all objects (origins for non-meshes), None if empty."""
+    points = []
+    for obj in objects:
+        matrix = np.array(obj.matrix_world, dtype=np.float64)
+        corners = np.array(obj.bound_box, dtype=np.float64) if obj.type == 'MESH' else np.zeros((1, 3))
+        points.append(corners @ matrix[:3, :3].T + matrix[:3, 3])
+    if not points:
+        return None
+    points = np.concatenate(points)
+    return points.min(axis=0), points.max(axis=0)
+
+def partition_tiles(objects, mode, tile_size):
+    """Splits the exported objects into chunks of whole hierarchies.
+
+    Returns {chunk key: objects}; key None is the shared base chunk with the global frames
+    (targets, sectors spanning several tiles, everything outside a sector in SECTOR mode).
+    Grid keys are (ix, iy), sector keys the sector's name.
+    """
+    objects = list(objects)
+    exported = set(objects)
+    by_name = {o.name: o for o in objects}
+    children = {}
+    for obj in objects:
+        if obj.parent in exported:
+            children.setdefault(obj.parent, []).append(obj)
+
+    def hierarchy(root):
+        result, stack = [], [root]
+        while stack:
+            obj = stack.pop()
+            result.append(obj)
+            # LOD levels travel with their base object
+            result.extend(lod for lod in (by_name.get(f"{obj.name}_lod{i}") for i in range(1, 10)) if lod)
+            stack.extend(children.get(obj, ()))
+        return result
+
+    def is_lod(obj):
+        base, _, level = obj.name.rpartition("_lod")
+        return bool(base) and level.isdigit() and base in by_name
+
+    def tile_of(point):
+        return int(math.floor(point[0] / tile_size)), int(math.floor(point[1] / tile_size))
+
+    chunks = {}
+    for root in (o for o in objects if o.parent not in exported and not is_lod(o)):
+        members = hierarchy(root)
+        is_sector = root.type == 'MESH' and "sector" in root.name.lower() and not is_portal(root)
+        if root.type == 'EMPTY' and root.empty_display_type == 'PLAIN_AXES':
+            key = None  # targets are looked up globally
+        elif mode == 'SECTOR':
+            key = root.name if is_sector else None
+        else:
+            bounds = world_bounds(members)
+            if is_sector and tile_of(bounds[0]) != tile_of(bounds[1]):
+                key = None
+            else:
+                key = tile_of((bounds[0] + bounds[1]) * 0.5)
+        chunks.setdefault(key, []).extend(members)
+    return chunks
+
+# --- TEXTURE ATLAS ---
+ATLAS_PADDING = 2  # border pixels replicated around every packed texture
+
+def write_bmp(path, pixels):
+    """Writes an (H, W, 3) uint8 RGB array (row 0 = bottom, Blender order) as a 24-bit BMP."""
+    height, width = pixels.shape[:2]
+    row_size = (width * 3 + 3) & ~3
+    rows = np.zeros((height, row_size), dtype=np.uint8)
+    rows[:, :width * 3] = pixels[:, :, ::-1].reshape(height, -1)  # BGR, bottom-up like BMP
+    with open(path, "wb") as f:
+        f.write(struct.pack("<2sIHHI", b"BM", 54 + rows.nbytes, 0, 0, 54))
+        f.write(struct.pack("<IiiHHIIiiII", 40, width, height, 1, 24, 0, rows.nbytes, 2835, 2835, 0, 0))
+        f.write(rows.tobytes())
+
+def shelf_pack(sizes, atlas_size):
+    """Packs (w, h) rectangles into atlas_size squares, tallest first, row by row.
+
+    Returns a (atlas index, x, y) placement per rectangle (None if it does not fit at all).
+    """
+    placements = [None] * len(sizes)
+    atlas = 0
+    x = y = shelf_height = 0
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        w, h = sizes[i]
+        if w > atlas_size or h > atlas_size:
+            continue
+        if x + w > atlas_size:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        if y + h > atlas_size:
+            atlas, x, y, shelf_height = atlas + 1, 0, 0, 0
+        placements[i] = (atlas, x, y)
+        x += w
+        shelf_height = max(shelf_height, h)
+    return placements
+
+# --- STATIC BATCHING ---
+CULL_COLLISION_MASK = 0x7E  # cull flag bits 1-6: player, AI, vehicle, camera, projectile, item collision
+# Modifiers whose result changes with the current frame
+TIME_DEPENDENT_MODIFIERS = {
+    'WAVE', 'OCEAN', 'EXPLODE', 'CLOTH', 'SOFT_BODY', 'COLLISION', 'DYNAMIC_PAINT', 'FLUID',
+    'PARTICLE_SYSTEM', 'PARTICLE_INSTANCE', 'MESH_CACHE', 'MESH_SEQUENCE_CACHE', 'NODES',
+}
+
+def is_deformed(obj):
+    """True if obj's evaluated mesh depends on other objects, the current frame or drivers."""
+    for m in obj.modifiers:
+        # Armature, hook, lattice, curve... (object); shrinkwrap, surface deform (target); mirror, array
+        if m.type in TIME_DEPENDENT_MODIFIERS or any(
+                getattr(m, attr, None) for attr in ("object", "target", "mirror_object", "offset_object")):
+            return True
+    mesh = obj.data
+    shape_keys = getattr(mesh, "shape_keys", None)
+    return bool(getattr(mesh, "animation_data", None) or (shape_keys and shape_keys.animation_data))
+
+def merge_lod_snapshots(snaps):
+    """Merges LOD snapshots (see snapshot_lod) into one, each moved by its 4x4 matrix.
+
+    snaps: list of (snapshot, matrix). Mirrored matrices flip the winding back.
+    """
+    co, loop_vi, loop_normals, loop_uv, tri_loops, tri_slot, slot_mat_ids = [], [], [], [], [], [], []
+    slot_uv_transforms = []
+    vert_offset = loop_offset = 0
+    for snap, matrix in snaps:
+        linear = matrix[:3, :3]
+        normal_matrix = np.linalg.inv(linear).T
+        co.append(snap['co'] @ linear.T + matrix[:3, 3])
+        normals = snap['loop_normals'] @ normal_matrix.T
+        loop_normals.append(normals / np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None])
+        num_loops = len(snap['loop_vi'])
+        loop_uv.append(snap['loop_uv'] if snap['loop_uv'] is not None else np.zeros((num_loops, 2), dtype=np.float32))
+        loops = snap['tri_loops'] + loop_offset
+        if np.linalg.det(linear) < 0:
+            loops = loops[:, [0, 2, 1]]
+        tri_loops.append(loops)
+        loop_vi.append(snap['loop_vi'] + vert_offset)
+        # Slots past the material list export with material 0 (extra trailing slot)
+        local_ids = list(snap['slot_mat_ids']) + [0]
+        tri_slot.append(np.minimum(snap['tri_slot'], len(local_ids) - 1) + len(slot_mat_ids))
+        slot_mat_ids.extend(local_ids)
+        slot_uv_transforms.extend(list(snap.get('slot_uv_transforms') or [None] * (len(local_ids) - 1)) + [None])
+        vert_offset += len(snap['co'])
+        loop_offset += num_loops
+    tri_slot = np.concatenate(tri_slot)
+    return {
+        'dist': snaps[0][0]['dist'],
+        'co': np.concatenate(co).astype(np.float32),
+        'loop_vi': np.concatenate(loop_vi),
+        'loop_normals': np.concatenate(loop_normals).astype(np.float32),
+        'loop_uv': np.concatenate(loop_uv),
+        'tri_loops': np.concatenate(tri_loops),
+        'tri_slot': tri_slot,
+        'slot_mat_ids': slot_mat_ids,
+        'slot_uv_transforms': slot_uv_transforms,
+    }
+
+def snapshot_draw_calls(snap):
+    """Face groups (draw calls) the snapshot exports as: distinct materials in use."""
+    slot_mat_ids = np.array(list(snap['slot_mat_ids']) + [0])
+    return len(np.unique(slot_mat_ids[np.minimum(snap['tri_slot'], len(slot_mat_ids) - 1)]))
+
+# --- VERTEX WELDING ---
+def grid_neighbor_pairs(points, cell_size):
+    """Candidate index pairs (i < j) of points in the same or adjacent spatial hash cells.
+
+    Any two points closer than cell_size are guaranteed to be returned.
+    """
+    n = len(points)
+    if n < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    cells = np.floor(points / cell_size).astype(np.int64)
+
+    def cell_hash(c):
+        # Collisions only add candidates, the caller checks real distances
+        return (c[:, 0] * 73856093) ^ (c[:, 1] * 19349663) ^ (c[:, 2] * 83492791)
+
+    order = np.argsort(cell_hash(cells), kind='stable')
+    sorted_hash = cell_hash(cells)[order]
+    pairs_i, pairs_j = [], []
+    for offset in np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1])).T.reshape(-1, 3):
+        target = cell_hash(cells + offset)
+        starts = np.searchsorted(sorted_hash, target, side='left')
+        counts = np.searchsorted(sorted_hash, target, side='right') - starts
+        owner = np.repeat(np.arange(n), counts)
+        before = np.repeat(np.cumsum(counts) - counts, counts)
+        other = order[np.repeat(starts, counts) + np.arange(len(owner)) - before]
+        keep = owner < other
+        pairs_i.append(owner[keep])
+        pairs_j.append(other[keep])
+    pairs = np.unique(np.stack((np.concatenate(pairs_i), np.concatenate(pairs_j)), axis=1), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+def connected_labels(n, pairs_i, pairs_j):
+    """Smallest member index of every point's connected component (vectorized union-find)."""
+    labels = np.arange(n)
+    while len(pairs_i):
+        low = np.minimum(labels[pairs_i], labels[pairs_j])
+        new = labels.copy()
+        np.minimum.at(new, pairs_i, low)
+        np.minimum.at(new, pairs_j, low)
+        new = new[new]  # pointer jumping
+        if np.array_equal(new, labels):
+            break
+        labels = new
+    return labels
+
+# --- VERTEX CACHE OPTIMIZATION ---
+VCACHE_SIZE = 32       # LRU cache modelled by the Forsyth scoring
+ACMR_FIFO_SIZE = 16    # FIFO post-transform cache used to measure ACMR (D3D-era hardware)
+
+def vcache_vertex_score(cache_pos, remaining):
+    """Forsyth vertex score: recently used vertices and vertices with few triangles left win."""
+    if remaining == 0:
+        return -1.0
+    score = 0.0
+    if cache_pos >= 0:
+        if cache_pos < 3:
+            score = 0.75
+        else:
+            score = (1.0 - (cache_pos - 3) / (VCACHE_SIZE - 3)) ** 1.5
+    return score + 2.0 * remaining ** -0.5
+
+def optimize_vertex_cache(tris, num_verts):
+    """Reorders triangles (M,3) for post-transform cache reuse (Tom Forsyth, linear-speed)."""
+    num_tris = len(tris)
+    if num_tris < 2:
+        return tris
+    tri_verts = tris.tolist()
+    flat = tris.reshape(-1)
+    counts = np.bincount(flat, minlength=num_verts)
+    offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
+    by_vertex = (np.argsort(flat, kind='stable') // 3).tolist()
+    vert_tris = [by_vertex[offsets[v]:offsets[v + 1]] for v in range(num_verts)]
+    remaining = counts.tolist()
+
+    cache_pos = [-1] * num_verts
+    vert_score = [vcache_vertex_score(-1, r) for r in remaining]
+    tri_score = [vert_score[a] + vert_score[b] + vert_score[c] for a, b, c in tri_verts]
+    emitted = [False] * num_tris
+    order = []
+    cache = []
+    best = max(range(num_tris), key=tri_score.__getitem__)
+    next_unemitted = 0
+
+    while True:
+        if best < 0:
+            # Nothing adjacent to the cache: continue with the next untouched triangle
+            while next_unemitted < num_tris and emitted[next_unemitted]:
+                next_unemitted += 1
+            if next_unemitted == num_tris:
+                break
+            best = next_unemitted
+
+        tri = tri_verts[best]
+        emitted[best] = True
+        order.append(best)
+        for v in tri:
+            vert_tris[v].remove(best)
+            remaining[v] -= 1
+
+        # LRU update, vertices pushed out of the cache lose their position score
+        new_cache = list(dict.fromkeys(tri + cache))
+        evicted = new_cache[VCACHE_SIZE:]
+        cache = new_cache[:VCACHE_SIZE]
+        for v in evicted:
+            cache_pos[v] = -1
+        for i, v in enumerate(cache):
+            cache_pos[v] = i
+
+        for v in cache + evicted:
+            score = vcache_vertex_score(cache_pos[v], remaining[v])
+            delta = score - vert_score[v]
+            vert_score[v] = score
+            for t in vert_tris[v]:
+                tri_score[t] += delta
+
+        # Best next triangle among those touching the cache
+        best = -1
+        best_score = -1.0
+        for v in cache:
+            for t in vert_tris[v]:
+                if tri_score[t] > best_score:
+                    best, best_score = t, tri_score[t]
+
+    return tris[np.array(order, dtype=np.int64)]
+
+def count_cache_misses(tris, cache_size=ACMR_FIFO_SIZE):
+    """Vertex transforms needed to draw tris through a FIFO post-transform cache."""
+    cache = deque()
+    in_cache = set()
+    misses = 0
+    for v in tris.reshape(-1).tolist():
+        if v in in_cache:
+            continue
+        misses += 1
+        if len(cache) == cache_size:
+            in_cache.discard(cache.popleft())
+        cache.append(v)
+        in_cache.add(v)
+    return misses
+
+# --- PASSTHROUGH (verbatim copy of untouched frames) ---
+def source_path(path):
+    """Normalized absolute path, used to match imported files against export targets."""
+    return os.path.normcase(os.path.abspath(path))
+
+def file_stamp(path):
+    """Size + mtime of a file; recorded byte ranges are only trusted while it matches."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+def frame_input_hash(obj, lods, visual_type):
+    """Hash of everything an object/billboard frame body is built from (mesh data, LOD distances,
+    source material ids, billboard settings). Same value at import and export = body unchanged."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((visual_type, getattr(obj, "rot_axis", ""), getattr(obj, "rot_mode", ""), len(lods))).encode())
+    for lod_obj in lods:
+        mesh = lod_obj.data
+        num_loops = len(mesh.loops)
+        h.update(repr((
+            round(float(getattr(lod_obj, "ls3d_lod_dist", 0.0)), 6),
+            len(mesh.vertices), num_loops, len(mesh.polygons),
+            [slot.material.get("ls3d_src_index", -1) if slot.material else -1 for slot in lod_obj.material_slots],
+        )).encode())
+
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", co)
+        loop_vi = np.empty(num_loops, dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vi)
+        loop_total = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("loop_total", loop_total)
+        poly_mat = np.empty(len(mesh.polygons), dtype=np.int32)
+        mesh.polygons.foreach_get("material_index", poly_mat)
+        normals = np.empty(num_loops * 3, dtype=np.float32)
+        if hasattr(mesh, "corner_normals"):
+            mesh.corner_normals.foreach_get("vector", normals)
+        else:
+            try: mesh.calc_normals_split()
+            except: pass
+            mesh.loops.foreach_get("normal", normals)
+        for arr in (co, loop_vi, loop_total, poly_mat, normals):
+            h.update(arr.tobytes())
+        if mesh.uv_layers.active:
+            uv = np.empty(num_loops * 2, dtype=np.float32)
+            mesh.uv_layers.active.data.foreach_get("uv", uv)
+            h.update(uv.tobytes())
+    return h.hexdigest()
+
+# --- INCREMENTAL EXPORT CACHE ---
+# Encoded frame blobs of previous exports: object pointer -> (fingerprint, blobs)
+_frame_cache = {}
+# Update counters per ID pointer, bumped by the depsgraph handler (a new tick marks it dirty)
+_update_ticks = {}
+
+@bpy.app.handlers.persistent
+def ls3d_depsgraph_update(scene, depsgraph):
+    for update in depsgraph.updates:
+        ptr = update.id.original.as_pointer()
+        _update_ticks[ptr] = _update_ticks.get(ptr, 0) + 1
+
+@bpy.app.handlers.persistent
+def ls3d_clear_frame_cache(*args):
+    # Undo/redo and file loads can swap datablocks without depsgraph updates
+    _frame_cache.clear()
+    _update_ticks.clear()
+
 class The4DSExporter:
-    def __init__(self, filepath, objects):
+    def __init__(self, filepath, objects, threads=0, use_cache=True, use_passthrough=True, use_instancing=True, optimize_vcache=False,
+                 generate_lods=False, lod_triangle_budget=1000, lod_ratios=(0.5, 0.25, 0.1),
+                 lod_pixel_error=1.0, lod_fov=math.radians(60.0), lod_screen_height=600,
+                 compute_lod_distances=False, cleanup_mesh=False,
+                 weld_vertices=False, weld_distance=1e-4, weld_uv_distance=1e-4, weld_angle=math.radians(5.0),
+                 dedup_materials=True, batch_static=False,
+                 atlas_textures=False, atlas_collection="", atlas_size=1024, atlas_max_texture=256):
         self.filepath = filepath
-        self.objects_to_export = objects
+        # Helper objects (e.g. room volumes used for sector generation) are never written
+        self.objects_to_export = [o for o in objects if not o.get("ls3d_no_export")]
+        self.threads = threads
+        self.use_cache = use_cache
+        self.use_passthrough = use_passthrough
+        self.use_instancing = use_instancing
+        self.optimize_vcache = optimize_vcache
+        self.generate_lods = generate_lods
+        self.lod_triangle_budget = lod_triangle_budget
+        self.lod_ratios = tuple(lod_ratios)
+        self.lod_pixel_error = lod_pixel_error
+        self.lod_fov = lod_fov
+        self.lod_screen_height = lod_screen_height
+        self.compute_lod_distances = compute_lod_distances
+        self.cleanup_mesh = cleanup_mesh
+        self.weld_vertices = weld_vertices
+        self.weld_distance = weld_distance
+        self.weld_uv_distance = weld_uv_distance
+        self.weld_angle = weld_angle
+        self.dedup_materials = dedup_materials
+        self.batch_static = batch_static
+        self.atlas_textures = atlas_textures
+        self.atlas_collection = atlas_collection
+        self.atlas_size = atlas_size
+        self.atlas_max_texture = atlas_max_texture
+        self.atlas_transforms = {}   # material -> (u0, v0, scale u, scale v, clamp u, clamp v)
+        self.batch_draw_calls = 0
+        self.material_blobs = None
+        self.double_sided_ids = frozenset()
+        self.generated_lod_count = 0
+        self.cache_hits = 0
+        self.passthrough_count = 0
+        self.instance_count = 0
+        self.shared_meshes = {}      # (mesh data, LOD dist, material ids) per LOD -> first object using it
+        self.instance_targets = {}   # object -> frame id holding its geometry
+        self.instance_blocks = {}    # encoded object block -> frame id
+        self.split_parts = {}        # object -> frame ids holding the geometry of its extra parts
+        self.source_maps = {}
         self.materials = []
         self.objects = []
         self.version = VERSION_MAFIA
@@ -434,6 +1649,43 @@ class The4DSExporter:
         self.joint_map = {}
         self.frame_index = 1
         self.lod_map = {}
+        self.material_index = {}
+        self.children_map = {}
+        self.depsgraph = None
+        self.temp_mesh_bytes = 0
+        self.peak_temp_mesh_bytes = 0
+        self.report_lines = []
+    def log(self, message):
+        print(message)
+        self.report_lines.append(message)
+    @contextmanager
+    def evaluated_mesh(self, obj):
+        """Yields a temporary evaluated mesh of obj and always frees it, even on exceptions."""
+        eval_obj = None
+        temp_mesh = None
+        size = 0
+        try:
+            try:
+                eval_obj = obj.evaluated_get(self.depsgraph)
+                temp_mesh = eval_obj.to_mesh()
+            except RuntimeError:
+                # Fallback copy is a real datablock, removed in finally
+                eval_obj = None
+                temp_mesh = obj.data.copy()
+            size = estimate_mesh_bytes(temp_mesh)
+            self.temp_mesh_bytes += size
+            self.peak_temp_mesh_bytes = max(self.peak_temp_mesh_bytes, self.temp_mesh_bytes)
+            yield temp_mesh
+        finally:
+            if temp_mesh is not None:
+                # Account for growth while in use (triangulation adds corners/faces)
+                grown = self.temp_mesh_bytes - size + estimate_mesh_bytes(temp_mesh)
+                self.peak_temp_mesh_bytes = max(self.peak_temp_mesh_bytes, grown)
+                self.temp_mesh_bytes -= size
+            if eval_obj is not None:
+                eval_obj.to_mesh_clear()
+            elif temp_mesh is not None:
+                bpy.data.meshes.remove(temp_mesh)
     def write_string(self, f, string):
         encoded = string.encode("windows-1250")
         f.write(struct.pack("B", len(encoded)))
@@ -442,19 +1694,155 @@ class The4DSExporter:
     def serialize_header(self, f):
         f.write(b"4DS\0")
         f.write(struct.pack("<H", self.version))
-        now = datetime.now()
-        epoch = datetime(1601, 1, 1)
-        delta = now - epoch
-        filetime = int(delta.total_seconds() * 1e7)
-        f.write(struct.pack("<Q", filetime))
+        f.write(struct.pack("<Q", filetime_now()))
     def collect_materials(self):
-        materials = set()
+        # Dict keeps first-use order, so material indices are stable between exports
+        materials = {}
         for obj in self.objects_to_export:
             if obj.type == 'MESH':
                 for slot in obj.material_slots:
                     if slot.material:
-                        materials.add(slot.material)
-        return list(materials)
+                        materials.setdefault(slot.material, None)
+        # Imported materials go first in their original file order, so untouched
+        # frames keep valid material ids and can be copied verbatim
+        imported = sorted(
+            (m for m in materials if "ls3d_src_index" in m),
+            key=lambda m: (m.get("ls3d_src_file", ""), m["ls3d_src_index"]),
+        )
+        return imported + [m for m in materials if "ls3d_src_index" not in m]
+    def merge_materials(self, materials):
+        """Writes every material once per distinct serialized content (Brick, Brick.001, ...).
+
+        Returns (unique materials, their serialized blobs, material -> file id for all materials).
+        """
+        unique = []
+        blobs = []
+        blob_ids = {}
+        material_index = {}
+        for mat in materials:
+            f = io.BytesIO()
+            self.serialize_material(f, mat, len(unique) + 1)
+            blob = f.getvalue()
+            if blob not in blob_ids:
+                unique.append(mat)
+                blobs.append(blob)
+                blob_ids[blob] = len(unique)
+            material_index[mat] = blob_ids[blob]
+        return unique, blobs, material_index
+
+    def atlas_candidates(self):
+        """Materials whose diffuse texture can move into an atlas: clamped (non-tiling), small,
+        single-texture and only used by objects of the atlas group."""
+        group = set(self.objects_to_export)
+        if self.atlas_collection:
+            collection = bpy.data.collections.get(self.atlas_collection)
+            group = set(collection.all_objects) if collection else set()
+        inside, outside = set(), set()
+        for obj in self.objects_to_export:
+            if obj.type == 'MESH':
+                target = inside if obj in group else outside
+                target.update(slot.material for slot in obj.material_slots if slot.material)
+
+        candidates = {}
+        for mat in inside - outside:
+            if mat not in self.material_index:
+                continue
+            # Wrapping UVs cannot be confined to an atlas rect; alpha/color key/animation need other textures
+            if mat.ls3d_misc_tile_u or mat.ls3d_misc_tile_v or not mat.ls3d_diff_enabled:
+                continue
+            if mat.ls3d_alpha_enabled or mat.ls3d_alpha_colorkey or mat.ls3d_alpha_imgalpha or mat.ls3d_diff_anim:
+                continue
+            image = self.diffuse_image(mat)
+            if image is None:
+                continue
+            width, height = image.size
+            if not (0 < width <= self.atlas_max_texture and 0 < height <= self.atlas_max_texture):
+                continue
+            candidates[mat] = image
+        return candidates
+
+    def atlas_maps_dir(self):
+        """'maps' next to the model's parent folder (Mafia layout) or next to the model, created if missing."""
+        model_dir = os.path.dirname(os.path.abspath(self.filepath))
+        for base in (os.path.dirname(model_dir), model_dir):
+            if os.path.isdir(base):
+                for name in os.listdir(base):
+                    if name.lower() == "maps" and os.path.isdir(os.path.join(base, name)):
+                        return os.path.join(base, name)
+        maps_dir = os.path.join(model_dir, "maps")
+        os.makedirs(maps_dir, exist_ok=True)
+        return maps_dir
+
+    def build_atlases(self):
+        """Packs candidate diffuse textures into shared BMP atlases, writes them to the maps
+        directory and replaces their materials by merged atlas materials (main thread only)."""
+        candidates = self.atlas_candidates()
+        if len(candidates) < 2:
+            return
+        mats = list(candidates)
+        images = list(dict.fromkeys(candidates.values()))
+        pad = ATLAS_PADDING
+        placements = shelf_pack([(img.size[0] + 2 * pad, img.size[1] + 2 * pad) for img in images], self.atlas_size)
+
+        num_atlases = max((p[0] for p in placements if p), default=-1) + 1
+        atlases = [np.zeros((self.atlas_size, self.atlas_size, 3), dtype=np.uint8) for _ in range(num_atlases)]
+        image_rects = {}
+        for img, placement in zip(images, placements):
+            if placement is None:
+                continue
+            width, height = img.size
+            pixels = np.empty(width * height * 4, dtype=np.float32)
+            img.pixels.foreach_get(pixels)
+            rgb = (np.clip(pixels.reshape(height, width, 4)[:, :, :3], 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+            atlas, x, y = placement
+            atlases[atlas][y:y + height + 2 * pad, x:x + width + 2 * pad] = np.pad(rgb, ((pad, pad), (pad, pad), (0, 0)), mode='edge')
+            image_rects[img] = (atlas, x + pad, y + pad, width, height)
+
+        base_name = os.path.splitext(os.path.basename(self.filepath))[0]
+        atlas_names = [f"{base_name}_atlas{i}.bmp" for i in range(num_atlases)]
+        maps_dir = self.atlas_maps_dir()
+        for name, pixels in zip(atlas_names, atlases):
+            write_bmp(os.path.join(maps_dir, name), pixels)
+
+        if self.material_blobs is None:
+            self.material_blobs = []
+            for i, mat in enumerate(self.materials):
+                f = io.BytesIO()
+                self.serialize_material(f, mat, i + 1)
+                self.material_blobs.append(f.getvalue())
+
+        # Members sharing everything but the texture become one material per atlas
+        size = float(self.atlas_size)
+        merged = {}
+        for mat in mats:
+            rect = image_rects.get(candidates[mat])
+            if rect is None:
+                continue
+            atlas, x, y, width, height = rect
+            f = io.BytesIO()
+            self.serialize_material(f, mat, 0, diffuse_override=atlas_names[atlas])
+            merged.setdefault(f.getvalue(), []).append(mat)
+            self.atlas_transforms[mat] = (x / size, y / size, width / size, height / size, 0.5 / width, 0.5 / height)
+
+        # Drop file materials only atlas members used, append the merged ones
+        members = set(self.atlas_transforms)
+        still_used = {mat_id for mat, mat_id in self.material_index.items() if mat not in members}
+        materials, blobs, remap = [], [], {}
+        for i, (mat, blob) in enumerate(zip(self.materials, self.material_blobs)):
+            if i + 1 in still_used:
+                materials.append(mat)
+                blobs.append(blob)
+                remap[i + 1] = len(materials)
+        self.material_index = {mat: remap[mat_id] for mat, mat_id in self.material_index.items() if mat not in members}
+        for blob, group in merged.items():
+            materials.append(group[0])
+            blobs.append(blob)
+            for mat in group:
+                self.material_index[mat] = len(materials)
+        self.log(f"Packed {len(image_rects)} textures into {num_atlases} atlases, "
+                 f"{len(self.materials)} -> {len(materials)} materials")
+        self.materials, self.material_blobs = materials, blobs
+
     def find_texture_node(self, node):
         """Recursively find an Image Texture node."""
         if not node:
@@ -483,68 +1871,143 @@ class The4DSExporter:
     
     
                 
-    def serialize_singlemesh(self, f, obj, num_lods):
+    def build_skin_table(self, lod_obj, bones, bone_parents):
+        """Clamps the bone influences of one LOD to what the format stores (main thread only).
+
+        A vertex is either locked to one bone, weighted between a bone and its parent
+        (the parent implicitly gets 1 - weight) or unweighted (follows the root). The strongest
+        of those options is kept and its weights renormalized. Returns per Blender vertex
+        'owner' bone (-1 = unweighted) and 'weight' of the owner, plus the clamped vertex count.
+        """
+        mesh = lod_obj.data
+        total_verts = len(mesh.vertices)
+
+        # Vertex group index -> bone index (groups without a bone are ignored)
+        group_to_bone = {}
+        for bone_idx, bone in enumerate(bones):
+            vg = lod_obj.vertex_groups.get(bone.name)
+            if vg: group_to_bone[vg.index] = bone_idx
+
+        owner = np.full(total_verts, -1, dtype=np.int32)
+        weight = np.ones(total_verts, dtype=np.float32)
+        clamped = 0
+        for v in mesh.vertices:
+            influences = {}
+            for g in v.groups:
+                bone_idx = group_to_bone.get(g.group)
+                if bone_idx is not None and g.weight > 0.001:
+                    influences[bone_idx] = influences.get(bone_idx, 0.0) + g.weight
+            if not influences:
+                continue
+            bone_idx = max(influences, key=influences.get)
+            best, used = influences[bone_idx], 1
+            for child, w in influences.items():
+                parent = bone_parents[child]
+                if parent in influences and w + influences[parent] > best:
+                    bone_idx, best, used = child, w + influences[parent], 2
+            share = influences[bone_idx] / best
+            if share <= 0.001:
+                bone_idx, share = bone_parents[bone_idx], 1.0
+            owner[v.index] = bone_idx
+            weight[v.index] = 1.0 if share >= 0.999 else share
+            if len(influences) > used:
+                clamped += 1
+        return {'owner': owner, 'weight': weight, 'clamped': clamped}
+
+    def snapshot_skin(self, obj, num_lods):
+        """Copies the skinning tables of every LOD (main thread only)."""
         armature_mod = next((m for m in obj.modifiers if m.type == 'ARMATURE'), None)
         if not armature_mod or not armature_mod.object:
-            return
+            return None
         armature = armature_mod.object
         bones = list(armature.data.bones)
-        total_verts = len(obj.data.vertices)
-        for _ in range(num_lods):
-            f.write(struct.pack("<B", len(bones)))
+
+        bone_index = {bone: i for i, bone in enumerate(bones)}
+        bone_parents = [bone_index.get(bone.parent, -1) for bone in bones]
+
+        # Inverse bind poses do not depend on the LOD, flatten them once
+        yz_swap = Matrix([[1,0,0,0], [0,0,1,0], [0,1,0,0], [0,0,0,1]])
+        inv_binds = []
+        for bone in bones:
+            inv = (bone.matrix_local @ yz_swap).inverted()
+            # Row-major flatten
+            inv_binds.append(struct.pack("<16f", *(inv[i][j] for i in range(4) for j in range(4))))
+
+        lods = self.lod_map.get(obj, [obj])
+        tables = {}
+        lod_tables = []
+        for lod_obj in lods[:num_lods]:
+            # LODs without their own weights reuse the base mesh table if the vertices line up
+            source = lod_obj if lod_obj.vertex_groups else obj
+            if len(source.data.vertices) != len(lod_obj.data.vertices):
+                source = lod_obj
+            if source.data not in tables:
+                tables[source.data] = self.build_skin_table(source, bones, bone_parents)
+            lod_tables.append(tables[source.data])
+        return {'inv_binds': inv_binds, 'tables': lod_tables}
+
+    def check_vertex_sources(self, name, geos, counts, what):
+        """Per-vertex tables come from the original mesh, exported vertices from the evaluated one;
+        modifiers that add vertices make them disagree (thread-safe)."""
+        for lod, (geo, count) in enumerate(zip(geos, counts)):
+            if len(geo['vert_src']) and int(geo['vert_src'].max()) >= count:
+                raise ExportError(f"{name}: LOD {lod} has more evaluated vertices than its mesh ({count}), "
+                                  f"{what} cannot be mapped; apply the modifiers that add vertices")
+
+    def skin_lod_geometry(self, geo, table, num_bones):
+        """Reorders exported vertices by owning bone (locked, then weighted; unweighted last)
+        so every bone's vertices form the contiguous ranges the bone table describes (thread-safe)."""
+        src = geo['vert_src']
+        owner = table['owner'][src] if len(table['owner']) else np.full(len(src), -1, dtype=np.int32)
+        weight = table['weight'][src] if len(table['weight']) else np.ones(len(src), dtype=np.float32)
+        owner_key = np.where(owner < 0, num_bones, owner)
+        order = np.lexsort((np.arange(len(src)), weight < 1.0, owner_key))
+        remap = np.empty_like(order)
+        remap[order] = np.arange(len(order))
+        for key in ('positions', 'normals', 'uvs', 'vert_src'):
+            geo[key] = geo[key][order]
+        geo['groups'] = [(mat_id, remap[tris]) for mat_id, tris in geo['groups']]
+        owner, weight, owner_key = owner[order], weight[order], owner_key[order]
+
+        positions = geo['positions']
+        if len(positions):
+            min_b, max_b = positions.min(axis=0), positions.max(axis=0)
+        else:
+            min_b = max_b = np.zeros(3)
+        bones = []
+        for bone_idx in range(num_bones):
+            start, end = np.searchsorted(owner_key, [bone_idx, bone_idx + 1])
+            locked = int(np.count_nonzero(weight[start:end] >= 1.0))
+            # Per-bone bounds from the vertices it owns, whole mesh if none
+            if end > start:
+                bone_min, bone_max = positions[start:end].min(axis=0), positions[start:end].max(axis=0)
+            else:
+                bone_min, bone_max = min_b, max_b
+            bones.append({'locked': locked, 'weights': weight[start + locked:end], 'min': bone_min, 'max': bone_max})
+        return {'unweighted_count': int(np.count_nonzero(owner < 0)), 'min': min_b, 'max': max_b, 'bones': bones}
+
+    def encode_singlemesh(self, f, skin, tables):
+        # tables come from skin_lod_geometry, bounds are already in file space
+        for table in tables:
+            f.write(struct.pack("<B", len(skin['inv_binds'])))
             # Unweighted verts count (assigned to root)
-            weighted_verts = set()
-            for v in obj.data.vertices:
-                if any(g.weight > 0.0 for g in v.groups):
-                    weighted_verts.add(v.index)
-            unweighted_count = total_verts - len(weighted_verts)
-            f.write(struct.pack("<I", unweighted_count))
-            # Mesh bounds
-            coords = [v.co for v in obj.data.vertices]
-            min_b = Vector((min(c[i] for c in coords) for i in range(3)))
-            max_b = Vector((max(c[i] for c in coords) for i in range(3)))
-            f.write(struct.pack("<3f", min_b.x, min_b.z, min_b.y))
-            f.write(struct.pack("<3f", max_b.x, max_b.z, max_b.y))
-            for bone_idx, bone in enumerate(bones):
-                # Inverse bind pose
-                mat = bone.matrix_local.copy()
-                # Y/Z swap for Mafia coord system
-                mat = mat @ Matrix([[1,0,0,0], [0,0,1,0], [0,1,0,0], [0,0,0,1]])
-                inv = mat.inverted()
-                # Row-major flatten
-                flat = [inv[i][j] for i in range(4) for j in range(4)]
-                f.write(struct.pack("<16f", *flat))
-                vg = obj.vertex_groups.get(bone.name)
-                if not vg:
-                    f.write(struct.pack("<4I", 0, 0, bone_idx, 0))
-                    f.write(struct.pack("<6f", min_b.x, min_b.z, min_b.y, max_b.x, max_b.z, max_b.y))
-                    continue
-                locked = []
-                weighted = []
-                weights = []
-                for v_idx in range(total_verts):
-                    try:
-                        weight = vg.weight(v_idx)
-                    except RuntimeError:
-                        continue
-                    if weight >= 0.999:
-                        locked.append(v_idx)
-                    elif weight > 0.001:
-                        weighted.append(v_idx)
-                        weights.append(weight)
-                f.write(struct.pack("<I", len(locked)))
-                f.write(struct.pack("<I", len(weighted)))
+            f.write(struct.pack("<I", table['unweighted_count']))
+            f.write(struct.pack("<3f", *table['min']))
+            f.write(struct.pack("<3f", *table['max']))
+            for bone_idx, bone_table in enumerate(table['bones']):
+                f.write(skin['inv_binds'][bone_idx])
+                f.write(struct.pack("<I", bone_table['locked']))
+                f.write(struct.pack("<I", len(bone_table['weights'])))
                 f.write(struct.pack("<I", bone_idx))
-                f.write(struct.pack("<3f", min_b.x, min_b.z, min_b.y))
-                f.write(struct.pack("<3f", max_b.x, max_b.z, max_b.y))
-                for w in weights:
-                    f.write(struct.pack("<f", w))
+                f.write(struct.pack("<3f", *bone_table['min']))
+                f.write(struct.pack("<3f", *bone_table['max']))
+                f.write(bone_table['weights'].astype("<f4").tobytes())
                     
-    def serialize_morph(self, f, obj, num_lods):
+    def snapshot_morph(self, obj, num_lods):
+        """Copies shape key coordinates of every LOD/channel/target into arrays (main thread only)."""
         shape_keys = obj.data.shape_keys
         if not shape_keys or len(shape_keys.key_blocks) <= 1:
-            f.write(struct.pack("<B", 0))
-            return
+            return {'num_targets': 0}
         morph_data = {}
         for key in shape_keys.key_blocks[1:]:
             parts = key.name.split("_")
@@ -559,39 +2022,128 @@ class The4DSExporter:
                         elif part.startswith("Channel"):
                             channel_idx = int(part[7:])
                     if lod_idx < num_lods:
-                        morph_data.setdefault(lod_idx, {}).setdefault(channel_idx, []).append((target_idx, key))
+                        morph_data.setdefault(lod_idx, {}).setdefault(channel_idx, {})[target_idx] = key
                 except:
                     continue
         num_targets = max((len(targets) for lod in morph_data.values() for targets in lod.values()), default=1)
         num_channels = max((len(lod) for lod in morph_data.values()), default=1)
-        f.write(struct.pack("<B", num_targets))
-        f.write(struct.pack("<B", num_channels))
-        f.write(struct.pack("<B", num_lods))
+
+        lods = self.lod_map.get(obj, [obj])
+        lod_snaps = []
         for lod_idx in range(num_lods):
+            lod_obj = lods[lod_idx] if lod_idx < len(lods) else obj
+            mesh = lod_obj.data
+            num_vertices = len(mesh.vertices)
+
+            basis = np.empty(num_vertices * 3, dtype=np.float32)
+            mesh.vertices.foreach_get("co", basis)
+            basis_normals = np.empty(num_vertices * 3, dtype=np.float32)
+            mesh.vertices.foreach_get("normal", basis_normals)
+            lod_keys = mesh.shape_keys.key_blocks if mesh.shape_keys else {}
+
+            channels = []
             for channel_idx in range(num_channels):
-                targets = morph_data.get(lod_idx, {}).get(channel_idx, [])
-                num_vertices = len(obj.data.vertices)
-                f.write(struct.pack("<H", num_vertices))
-                for vert_idx in range(num_vertices):
-                    for target_idx in range(num_targets):
-                        target_key = next((k for t, k in targets if t == target_idx), None)
-                        pos = target_key.data[vert_idx].co if target_key else obj.data.vertices[vert_idx].co
-                        norm = obj.data.vertices[vert_idx].normal
-                        f.write(struct.pack("<3f", pos.x, pos.z, pos.y))
-                        f.write(struct.pack("<3f", norm.x, norm.z, norm.y))
-                f.write(struct.pack("<?", False))
-            bounds = [v.co for v in obj.data.vertices]
-            min_bounds = Vector((min(v.x for v in bounds), min(v.y for v in bounds), min(v.z for v in bounds)))
-            max_bounds = Vector((max(v.x for v in bounds), max(v.y for v in bounds), max(v.z for v in bounds)))
-            center = (min_bounds + max_bounds) / 2
-            dist = (max_bounds - min_bounds).length
-            f.write(struct.pack("<3f", min_bounds.x, min_bounds.z, min_bounds.y))
-            f.write(struct.pack("<3f", max_bounds.x, max_bounds.z, max_bounds.y))
-            f.write(struct.pack("<3f", center.x, center.z, center.y))
+                targets = morph_data.get(lod_idx, {}).get(channel_idx, {})
+                channel = {}
+                for target_idx in range(num_targets):
+                    key = targets.get(target_idx)
+                    # Only keys living on this LOD's mesh can be addressed
+                    key = lod_keys.get(key.name) if key else None
+                    if not key:
+                        continue
+                    co = np.empty(num_vertices * 3, dtype=np.float32)
+                    key.data.foreach_get("co", co)
+                    normals = np.array(key.normals_vertex_get(), dtype=np.float32)
+                    channel[target_idx] = (co.reshape(-1, 3), normals.reshape(-1, 3))
+                channels.append(channel)
+
+            lod_snaps.append({
+                'basis': basis.reshape(-1, 3),
+                'basis_normals': basis_normals.reshape(-1, 3),
+                'channels': channels,
+            })
+        return {'num_targets': num_targets, 'num_channels': num_channels, 'lods': lod_snaps}
+
+    def encode_morph(self, f, morph, geos):
+        num_targets = morph['num_targets']
+        if not num_targets:
+            f.write(struct.pack("<B", 0))
+            return
+        f.write(struct.pack("<B", num_targets))
+        f.write(struct.pack("<B", morph['num_channels']))
+        f.write(struct.pack("<B", len(morph['lods'])))
+
+        for lod, geo in zip(morph['lods'], geos):
+            basis = lod['basis']
+            num_vertices = len(basis)
+            # Exported vertex -> Blender vertex of this LOD
+            sources = geo['vert_src']
+
+            bounds_min = basis.min(axis=0) if num_vertices else np.zeros(3, dtype=np.float32)
+            bounds_max = basis.max(axis=0) if num_vertices else np.zeros(3, dtype=np.float32)
+
+            for channel in lod['channels']:
+                # Targets default to the basis
+                positions = np.repeat(basis[:, None, :], num_targets, axis=1)
+                normals = np.repeat(lod['basis_normals'][:, None, :], num_targets, axis=1)
+                moved = np.zeros(num_vertices, dtype=bool)
+                for target_idx, (co, target_normals) in channel.items():
+                    positions[:, target_idx] = co
+                    normals[:, target_idx] = target_normals
+                    moved |= np.any(np.abs(co - basis) > 1e-6, axis=1)
+
+                # Sparse block: only exported vertices whose source moved in some target
+                indices = np.nonzero(moved[sources])[0] if len(sources) else np.zeros(0, dtype=np.int64)
+                f.write(struct.pack("<H", len(indices)))
+                if not len(indices):
+                    continue
+                src = sources[indices]
+                block = np.concatenate((positions[src], normals[src]), axis=2)
+                # Y/Z swap for Mafia coord system
+                block = block[:, :, [0, 2, 1, 3, 5, 4]]
+                f.write(block.astype("<f4").tobytes())
+                f.write(struct.pack("<?", True))
+                f.write(indices.astype("<u2").tobytes())
+
+                moved_positions = positions[src].reshape(-1, 3)
+                bounds_min = np.minimum(bounds_min, moved_positions.min(axis=0))
+                bounds_max = np.maximum(bounds_max, moved_positions.max(axis=0))
+
+            center = (bounds_min + bounds_max) / 2
+            dist = float(np.linalg.norm(bounds_max - bounds_min))
+            f.write(struct.pack("<3f", bounds_min[0], bounds_min[2], bounds_min[1]))
+            f.write(struct.pack("<3f", bounds_max[0], bounds_max[2], bounds_max[1]))
+            f.write(struct.pack("<3f", center[0], center[2], center[1]))
             f.write(struct.pack("<f", dist))
+    def check_bounds(self, obj, stored_min, stored_max, min_bounds, max_bounds):
+        """Lists stored bbox props (unset = all zero) that disagree with the computed bounds."""
+        stored = np.array([stored_min, stored_max], dtype=np.float64)
+        computed = np.array([min_bounds, max_bounds], dtype=np.float64)
+        if stored.any() and not np.allclose(stored, computed, atol=1e-3 * max(1.0, float(np.abs(computed).max()))):
+            self.bounds_mismatches.append(
+                f"{obj.name}: stored {tuple(np.round(stored[0], 3))}..{tuple(np.round(stored[1], 3))}, "
+                f"actual {tuple(np.round(computed[0], 3))}..{tuple(np.round(computed[1], 3))}")
+
+    def dummy_bounds(self, obj):
+        """Local box of the meshes below the dummy; without any, the stored box or the display cube."""
+        stored_min = tuple(obj.get("bbox_min", (0.0, 0.0, 0.0)))
+        stored_max = tuple(obj.get("bbox_max", (0.0, 0.0, 0.0)))
+        meshes = [c for c in obj.children_recursive if c.type == 'MESH' and not is_portal(c)]
+        if meshes:
+            points = local_points(obj, meshes)
+            min_bounds, max_bounds = points.min(axis=0), points.max(axis=0)
+        else:
+            # The stored box may be off-center, keep it while it still matches the displayed cube
+            size = obj.empty_display_size
+            half_extent = max(b - a for a, b in zip(stored_min, stored_max)) * 0.5
+            if abs(half_extent - size) <= 1e-3 * max(1.0, size):
+                return stored_min, stored_max
+            min_bounds, max_bounds = (-size, -size, -size), (size, size, size)
+        self.check_bounds(obj, stored_min, stored_max, min_bounds, max_bounds)
+        return min_bounds, max_bounds
+
     def serialize_dummy(self, f, obj):
-        min_bounds = obj.get("bbox_min", (0.0, 0.0, 0.0))
-        max_bounds = obj.get("bbox_max", (0.0, 0.0, 0.0))
+        min_bounds, max_bounds = self.dummy_bounds(obj)
         f.write(struct.pack("<3f", min_bounds[0], min_bounds[2], min_bounds[1]))
         f.write(struct.pack("<3f", max_bounds[0], max_bounds[2], max_bounds[1]))
     def serialize_target(self, f, obj):
@@ -604,27 +2156,41 @@ class The4DSExporter:
     def serialize_occluder(self, f, obj):
         mesh = obj.data
         bm = bmesh.new()
-        bm.from_mesh(mesh)
-        bm.verts.ensure_lookup_table()
-        bm.faces.ensure_lookup_table()
-        f.write(struct.pack("<I", len(bm.verts)))
-        f.write(struct.pack("<I", len(bm.faces)))
-        for vert in bm.verts:
-            pos = vert.co
-            f.write(struct.pack("<3f", pos.x, pos.z, pos.y))
-        for face in bm.faces:
-            idxs = [vert.index for vert in face.verts]
-            f.write(struct.pack("<3H", idxs[0], idxs[2], idxs[1]))
-        bm.free()
-    def serialize_joint(self, f, bone, armature, parent_id):
+        try:
+            bm.from_mesh(mesh)
+            bm.verts.ensure_lookup_table()
+            bm.faces.ensure_lookup_table()
+            if len(bm.verts) > MAX_VERTICES:
+                raise ExportError(f"{obj.name}: occluder has {len(bm.verts)} vertices, the limit is {MAX_VERTICES}")
+            f.write(struct.pack("<I", len(bm.verts)))
+            f.write(struct.pack("<I", len(bm.faces)))
+            for vert in bm.verts:
+                pos = vert.co
+                f.write(struct.pack("<3f", pos.x, pos.z, pos.y))
+            for face in bm.faces:
+                idxs = [vert.index for vert in face.verts]
+                f.write(struct.pack("<3H", idxs[0], idxs[2], idxs[1]))
+        finally:
+            bm.free()
+    def serialize_joint(self, f, bone, bone_idx):
         matrix = bone.matrix_local.copy()
         matrix[1], matrix[2] = matrix[2].copy(), matrix[1].copy()
         flat = [matrix[i][j] for i in range(4) for j in range(3)]
         f.write(struct.pack("<12f", *flat))
-        bone_idx = list(armature.data.bones).index(bone)
         f.write(struct.pack("<I", bone_idx))
     
-    def serialize_material(self, f, mat, mat_index):
+    def diffuse_image(self, mat):
+        """Image of the texture node linked to the LS3D node's Diffuse Map input, if any."""
+        if not (mat.use_nodes and mat.node_tree):
+            return None
+        ls3d_node = next((n for n in mat.node_tree.nodes if n.type == 'GROUP' and n.node_tree and "LS3D Material Data" in n.node_tree.name), None)
+        if ls3d_node and "Diffuse Map" in ls3d_node.inputs and ls3d_node.inputs["Diffuse Map"].is_linked:
+            tex = self.find_texture_node(ls3d_node.inputs["Diffuse Map"].links[0].from_node)
+            if tex and tex.image:
+                return tex.image
+        return None
+
+    def serialize_material(self, f, mat, mat_index, diffuse_override=None):
         # 1. Colors & Opacity
         env_color = getattr(mat, "ls3d_ambient_color", (0.5, 0.5, 0.5))
         diffuse_color = getattr(mat, "ls3d_diffuse_color", (1.0, 1.0, 1.0))
@@ -689,9 +2255,8 @@ class The4DSExporter:
              ls3d_node = next((n for n in nodes if n.type == 'GROUP' and n.node_tree and "LS3D Material Data" in n.node_tree.name), None)
              
              if ls3d_node:
-                 if "Diffuse Map" in ls3d_node.inputs and ls3d_node.inputs["Diffuse Map"].is_linked:
-                     tex = self.find_texture_node(ls3d_node.inputs["Diffuse Map"].links[0].from_node)
-                     if tex and tex.image: diffuse_tex = os.path.basename(tex.image.filepath or tex.image.name)
+                 image = self.diffuse_image(mat)
+                 if image: diffuse_tex = os.path.basename(image.filepath or image.name)
                  
                  if mat.ls3d_alpha_enabled and "Alpha Map" in ls3d_node.inputs and ls3d_node.inputs["Alpha Map"].is_linked:
                      tex = self.find_texture_node(ls3d_node.inputs["Alpha Map"].links[0].from_node)
@@ -709,223 +2274,796 @@ class The4DSExporter:
                          if tex and tex.image: 
                              env_tex = os.path.basename(tex.image.filepath or tex.image.name); env_opacity = 1.0
 
-        if mat.ls3d_env_enabled:
-            f.write(struct.pack("<f", env_opacity))
-            self.write_string(f, env_tex.upper())
-        self.write_string(f, diffuse_tex.upper())
-        if mat.ls3d_alpha_enabled:
-            self.write_string(f, alpha_tex.upper())
-            
-        if mat.ls3d_diff_anim:
-            f.write(struct.pack("<I", mat.ls3d_diff_frame_count))
-            f.write(struct.pack("<H", 0))
-            f.write(struct.pack("<I", mat.ls3d_diff_frame_period))
-            f.write(struct.pack("<I", 0))
-            f.write(struct.pack("<I", 0))
+        if diffuse_override is not None:
+            diffuse_tex = diffuse_override
+
+        if mat.ls3d_env_enabled:
+            f.write(struct.pack("<f", env_opacity))
+            self.write_string(f, env_tex.upper())
+        self.write_string(f, diffuse_tex.upper())
+        if mat.ls3d_alpha_enabled:
+            self.write_string(f, alpha_tex.upper())
+            
+        if mat.ls3d_diff_anim:
+            f.write(struct.pack("<I", mat.ls3d_diff_frame_count))
+            f.write(struct.pack("<H", 0))
+            f.write(struct.pack("<I", mat.ls3d_diff_frame_period))
+            f.write(struct.pack("<I", 0))
+            f.write(struct.pack("<I", 0))
+
+    def snapshot_lod(self, lod_obj):
+        """Copies one LOD's triangulated geometry into arrays (main thread only)."""
+        # --- 1. HANDLE FADE DISTANCE ---
+        # STRICTLY READ FROM UI: No auto-correction, no forcing LOD0 to 0.
+        # We trust the user has set the correct value in the panel.
+        dist = float(getattr(lod_obj, "ls3d_lod_dist", 0.0))
+
+        # --- 2. MESH PROCESSING ---
+        # Temp mesh (and its bmesh) are freed on exit, even if extraction fails
+        with self.evaluated_mesh(lod_obj) as temp_mesh:
+            # Triangulate
+            bm = bmesh.new()
+            try:
+                bm.from_mesh(temp_mesh)
+                bmesh.ops.triangulate(bm, faces=bm.faces, quad_method='BEAUTY', ngon_method='BEAUTY')
+                bm.to_mesh(temp_mesh)
+            finally:
+                bm.free()
+
+            num_verts = len(temp_mesh.vertices)
+            num_loops = len(temp_mesh.loops)
+            num_tris = len(temp_mesh.polygons)
+
+            co = np.empty(num_verts * 3, dtype=np.float32)
+            temp_mesh.vertices.foreach_get("co", co)
+            loop_vi = np.empty(num_loops, dtype=np.int32)
+            temp_mesh.loops.foreach_get("vertex_index", loop_vi)
+
+            # Corner normals (Blender 4.1+), split normals on older versions
+            loop_normals = np.empty(num_loops * 3, dtype=np.float32)
+            if hasattr(temp_mesh, "corner_normals"):
+                temp_mesh.corner_normals.foreach_get("vector", loop_normals)
+            else:
+                try: temp_mesh.calc_normals_split()
+                except: pass
+                temp_mesh.loops.foreach_get("normal", loop_normals)
+
+            loop_uv = None
+            if temp_mesh.uv_layers.active:
+                loop_uv = np.empty(num_loops * 2, dtype=np.float32)
+                temp_mesh.uv_layers.active.data.foreach_get("uv", loop_uv)
+                loop_uv = loop_uv.reshape(-1, 2)
+
+            loop_start = np.empty(num_tris, dtype=np.int32)
+            temp_mesh.polygons.foreach_get("loop_start", loop_start)
+            tri_slot = np.empty(num_tris, dtype=np.int32)
+            temp_mesh.polygons.foreach_get("material_index", tri_slot)
+
+        # Material slot -> file material id (0 = none)
+        slot_mat_ids = [self.material_index.get(slot.material, 0) for slot in lod_obj.material_slots]
+        slot_uv_transforms = [self.atlas_transforms.get(slot.material) for slot in lod_obj.material_slots]
+
+        return {
+            'dist': dist,
+            'co': co.reshape(-1, 3),
+            'loop_vi': loop_vi,
+            'loop_normals': loop_normals.reshape(-1, 3),
+            'loop_uv': loop_uv,
+            'tri_loops': loop_start[:, None] + np.arange(3, dtype=np.int32),
+            'tri_slot': tri_slot,
+            'slot_mat_ids': slot_mat_ids,
+            'slot_uv_transforms': slot_uv_transforms,
+        }
+
+    def build_lod_geometry(self, lod):
+        """Deduplicates one LOD snapshot into exported vertex/index arrays (thread-safe)."""
+        loop_vi = lod['loop_vi']
+        num_loops = len(loop_vi)
+        co = lod['co'][loop_vi].astype(np.float64)
+        normals = lod['loop_normals'].astype(np.float64)
+        uvs = np.zeros((num_loops, 2), dtype=np.float64)
+        if lod['loop_uv'] is not None:
+            loop_uv = lod['loop_uv'].astype(np.float64)
+            # Atlas members: clamp into the texture (half a texel in) and move into its atlas rect
+            for slot, transform in enumerate(lod.get('slot_uv_transforms') or ()):
+                if transform is None:
+                    continue
+                u0, v0, su, sv, cu, cv = transform
+                loops = lod['tri_loops'][lod['tri_slot'] == slot].reshape(-1)
+                loop_uv[loops, 0] = u0 + np.clip(loop_uv[loops, 0], cu, 1.0 - cu) * su
+                loop_uv[loops, 1] = v0 + np.clip(loop_uv[loops, 1], cv, 1.0 - cv) * sv
+            uvs[:, 0] = loop_uv[:, 0]
+            uvs[:, 1] = 1.0 - loop_uv[:, 1]
+
+        if num_loops:
+            # Deduplication Key: quantization to 5 decimals
+            keys = np.trunc(np.concatenate((co, normals, uvs), axis=1) * 100000.0).astype(np.int64)
+            _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+            # Number unique vertices in order of first use (matches the old dict-based order)
+            order = np.argsort(first, kind='stable')
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            loop_to_vert = rank[inverse.reshape(-1)]
+            vert_loop = first[order]
+        else:
+            loop_to_vert = np.zeros(0, dtype=np.int64)
+            vert_loop = np.zeros(0, dtype=np.int64)
+
+        tris = loop_to_vert[lod['tri_loops']]
+        tri_slot = lod['tri_slot']
+
+        # Face groups per file material, in order of first appearance
+        # (slots pointing to the same or merged materials share one group)
+        slot_mat_ids = np.array(list(lod['slot_mat_ids']) + [0], dtype=np.int64)
+        tri_mat = slot_mat_ids[np.minimum(tri_slot, len(slot_mat_ids) - 1)]
+        groups = []
+        mat_ids, first_tri = np.unique(tri_mat, return_index=True)
+        for mat_id in mat_ids[np.argsort(first_tri)]:
+            groups.append((int(mat_id), tris[tri_mat == mat_id]))
+
+        return {
+            'dist': lod['dist'],
+            'positions': co[vert_loop][:, [0, 2, 1]],
+            'normals': normals[vert_loop][:, [0, 2, 1]],
+            'uvs': uvs[vert_loop],
+            # Source Blender vertex of every exported vertex (for morphs)
+            'vert_src': loop_vi[vert_loop],
+            'groups': groups,
+        }
+
+    def weld_lod_geometry(self, geo, same_source=False):
+        """Merges vertices within the position/UV tolerance whose normals differ less than the
+        weld angle (spatial hash grid, thread-safe). With same_source only vertices of the same
+        Blender vertex are merged (skin and morph data refer to them). Returns vertices removed.
+        """
+        positions = geo['positions']
+        num_verts = len(positions)
+        pairs_i, pairs_j = grid_neighbor_pairs(positions, max(self.weld_distance, 1e-9))
+        if not len(pairs_i):
+            return 0
+        normals = geo['normals']
+        normals = normals / np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+        match = (
+            (np.linalg.norm(positions[pairs_i] - positions[pairs_j], axis=1) <= self.weld_distance)
+            & (np.abs(geo['uvs'][pairs_i] - geo['uvs'][pairs_j]).max(axis=1) <= self.weld_uv_distance)
+            & ((normals[pairs_i] * normals[pairs_j]).sum(axis=1) >= math.cos(self.weld_angle))
+        )
+        if same_source:
+            match &= geo['vert_src'][pairs_i] == geo['vert_src'][pairs_j]
+        labels = connected_labels(num_verts, pairs_i[match], pairs_j[match])
 
-    def serialize_object(self, f, obj, lods):
-        f.write(struct.pack("<H", 0))
-        f.write(struct.pack("<B", len(lods)))
-        
-        # Initialize storage to prevent crash
-        self.current_lod_mappings = [] 
-        self.current_lod_counts = []
-        
-        # Helper: Quantization for vertex deduplication (5 decimals)
-        def quant(val):
-            if abs(val) < 0.00001: val = 0.0
-            return int(val * 100000.0)
+        # The first vertex of every cluster represents it
+        keep = labels == np.arange(num_verts)
+        removed = num_verts - int(np.count_nonzero(keep))
+        if removed:
+            remap = (np.cumsum(keep) - 1)[labels]
+            for key in ('positions', 'normals', 'uvs', 'vert_src'):
+                geo[key] = geo[key][keep]
+            geo['groups'] = [(mat_id, remap[tris]) for mat_id, tris in geo['groups']]
+        return removed
 
-        for lod_idx, lod_obj in enumerate(lods):
-            # --- 1. HANDLE FADE DISTANCE ---
-            # STRICTLY READ FROM UI: No auto-correction, no forcing LOD0 to 0.
-            # We trust the user has set the correct value in the panel.
-            dist = getattr(lod_obj, "ls3d_lod_dist", 0.0)
-            
-            f.write(struct.pack("<f", float(dist)))
-            
-            # --- 2. MESH PROCESSING ---
-            try:
-                # Blender 5.0 safe evaluation
-                depsgraph = bpy.context.evaluated_depsgraph_get()
-                eval_obj = lod_obj.evaluated_get(depsgraph)
-                temp_mesh = eval_obj.to_mesh()
-            except:
-                temp_mesh = lod_obj.data.copy()
+    def cleanup_lod_geometry(self, geo):
+        """Drops degenerate and duplicate triangles and strips unreferenced vertices (thread-safe).
 
-            # Triangulate
-            bm = bmesh.new()
-            bm.from_mesh(temp_mesh)
-            bmesh.ops.triangulate(bm, faces=bm.faces, quad_method='BEAUTY', ngon_method='BEAUTY')
-            bm.to_mesh(temp_mesh)
-            bm.free()
-            
-            # Access Data Layers
-            uv_layer = temp_mesh.uv_layers.active.data if temp_mesh.uv_layers.active else None
-            unique_verts = {}
-            final_verts = []
-            mat_groups = {}
-            vert_map = {} 
-            
-            # Ensure normals are ready
-            try: temp_mesh.calc_normals_split()
-            except: pass
+        Triangles that only differ in winding count as duplicates in double-sided groups, where
+        both sides render anyway. Returns (triangles removed, vertices removed).
+        """
+        positions = geo['positions']
+        removed_tris = 0
+        groups = []
+        for mat_id, tris in geo['groups']:
+            if len(tris):
+                a, b, c = (positions[tris[:, i]] for i in range(3))
+                keep = (
+                    (tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 0] != tris[:, 2])
+                    & (np.linalg.norm(np.cross(b - a, c - a), axis=1) > 1e-12)
+                )
+                kept = tris[keep]
+                if mat_id in self.double_sided_ids:
+                    keys = np.sort(kept, axis=1)
+                else:
+                    # Rotate the smallest index first, winding is preserved
+                    shift = np.argmin(kept, axis=1)
+                    keys = kept[np.arange(len(kept))[:, None], (shift[:, None] + np.arange(3)) % 3]
+                if len(kept):
+                    _, first = np.unique(keys, axis=0, return_index=True)
+                    kept = kept[np.sort(first)]
+                removed_tris += len(tris) - len(kept)
+                tris = kept
+            groups.append((mat_id, tris))
+
+        num_verts = len(positions)
+        used = np.zeros(num_verts, dtype=bool)
+        for _, tris in groups:
+            used[tris.reshape(-1)] = True
+        removed_verts = num_verts - int(np.count_nonzero(used))
+        if removed_verts:
+            remap = np.cumsum(used) - 1
+            for key in ('positions', 'normals', 'uvs', 'vert_src'):
+                geo[key] = geo[key][used]
+            groups = [(mat_id, remap[tris]) for mat_id, tris in groups]
+        # Groups emptied by the cleanup are not written
+        geo['groups'] = [(mat_id, tris) for mat_id, tris in groups if len(tris)]
+        return removed_tris, removed_verts
+
+    def optimize_lod_geometry(self, geo, renumber=True):
+        """Reorders each face group for vertex cache reuse, then renumbers vertices in first-use
+        order (skipped for skinned meshes). Returns (triangles, misses before, misses after)."""
+        num_verts = len(geo['positions'])
+        num_tris = misses_before = misses_after = 0
+        groups = []
+        for mat_id, tris in geo['groups']:
+            misses_before += count_cache_misses(tris)
+            tris = optimize_vertex_cache(tris, num_verts)
+            misses_after += count_cache_misses(tris)
+            num_tris += len(tris)
+            groups.append((mat_id, tris))
+
+        if renumber and num_verts and groups:
+            flat = np.concatenate([tris.reshape(-1) for _, tris in groups])
+            used, first = np.unique(flat, return_index=True)
+            new_order = used[np.argsort(first, kind='stable')]
+            # Vertices not referenced by any triangle keep their relative order at the end
+            unused = np.setdiff1d(np.arange(num_verts), used)
+            new_order = np.concatenate((new_order, unused))
+            remap = np.empty(num_verts, dtype=np.int64)
+            remap[new_order] = np.arange(num_verts)
+            for key in ('positions', 'normals', 'uvs', 'vert_src'):
+                geo[key] = geo[key][new_order]
+            groups = [(mat_id, remap[tris]) for mat_id, tris in groups]
+
+        geo['groups'] = groups
+        return num_tris, misses_before, misses_after
+
+    def split_lod_geometry(self, geos):
+        """Partitions oversized LODs spatially so every part stays under the 16-bit vertex limit.
+
+        Triangles are split recursively at the median centroid along the longest axis; all LODs
+        are cut by the same planes so parts line up. Returns one list of LOD geometries per part.
+        """
+        lods = []
+        for geo in geos:
+            if geo['groups']:
+                tris = np.concatenate([tris for _, tris in geo['groups']])
+                tri_group = np.concatenate([np.full(len(tris), g) for g, (_, tris) in enumerate(geo['groups'])])
+            else:
+                tris = np.zeros((0, 3), dtype=np.int64)
+                tri_group = np.zeros(0, dtype=np.int64)
+            lods.append((tris, tri_group, geo['positions'][tris].mean(axis=1)))
+
+        leaves = []
+        stack = [[np.arange(len(tris)) for tris, _, _ in lods]]
+        while stack:
+            selection = stack.pop()
+            sizes = [len(np.unique(tris[sel])) for (tris, _, _), sel in zip(lods, selection)]
+            if max(sizes) <= MAX_VERTICES:
+                leaves.append(selection)
+                continue
+            worst = int(np.argmax(sizes))
+            centroids = lods[worst][2][selection[worst]]
+            axis = int(np.argmax(centroids.max(axis=0) - centroids.min(axis=0)))
+            median = float(np.median(centroids[:, axis]))
+            left = [sel[centroids_all[sel, axis] < median] for (_, _, centroids_all), sel in zip(lods, selection)]
+            right = [sel[centroids_all[sel, axis] >= median] for (_, _, centroids_all), sel in zip(lods, selection)]
+            if not len(left[worst]) or not len(right[worst]):
+                # Centroids piled on one plane: fall back to halving in triangle order
+                left = [sel[:len(sel) // 2] for sel in selection]
+                right = [sel[len(sel) // 2:] for sel in selection]
+            stack.append(right)
+            stack.append(left)
+
+        parts = []
+        for selection in leaves:
+            part = []
+            for geo, (tris, tri_group, _), sel in zip(geos, lods, selection):
+                used, local = np.unique(tris[sel], return_inverse=True)
+                local = local.reshape(-1, 3)
+                groups = []
+                for g, (mat_id, _) in enumerate(geo['groups']):
+                    mask = tri_group[sel] == g
+                    if mask.any():
+                        groups.append((mat_id, local[mask]))
+                part.append({
+                    'dist': geo['dist'],
+                    'positions': geo['positions'][used],
+                    'normals': geo['normals'][used],
+                    'uvs': geo['uvs'][used],
+                    'vert_src': geo['vert_src'][used],
+                    'groups': groups,
+                })
+            parts.append(part)
+        return parts
+
+    def encode_object(self, f, geos):
+        f.write(struct.pack("<H", 0))
+        f.write(struct.pack("<B", len(geos)))
+        for geo in geos:
+            f.write(struct.pack("<f", geo['dist']))
+            f.write(struct.pack("<H", len(geo['positions'])))
+            vertices = np.concatenate((geo['positions'], geo['normals'], geo['uvs']), axis=1)
+            f.write(vertices.astype("<f4").tobytes())
             
-            for poly in temp_mesh.polygons:
-                f_indices = []
-                for loop_index in poly.loop_indices:
-                    loop = temp_mesh.loops[loop_index]
-                    v_index = loop.vertex_index
-                    v_co = temp_mesh.vertices[v_index].co
-                    
-                    u, v_coord = (0.0, 0.0)
-                    if uv_layer:
-                        d = uv_layer[loop_index].uv
-                        u, v_coord = d[0], 1.0 - d[1]
-                    
-                    norm = loop.normal
-                    
-                    # Deduplication Key
-                    key = (
-                        quant(v_co.x), quant(v_co.y), quant(v_co.z),
-                        quant(norm.x), quant(norm.y), quant(norm.z),
-                        quant(u), quant(v_coord)
-                    )
-                    
-                    if key in unique_verts:
-                        idx = unique_verts[key]
-                    else:
-                        idx = len(final_verts)
-                        unique_verts[key] = idx
-                        final_verts.append({
-                            'pos': (v_co.x, v_co.z, v_co.y),
-                            'norm': (norm.x, norm.z, norm.y),
-                            'uv': (u, v_coord)
-                        })
-                    
-                    # Map for skinning
-                    if v_index not in vert_map: vert_map[v_index] = []
-                    if idx not in vert_map[v_index]: vert_map[v_index].append(idx)
-                    
-                    f_indices.append(idx)
-                
-                mat_groups.setdefault(poly.material_index, []).append(f_indices)
-            
-            lod_obj.to_mesh_clear()
-            
-            self.current_lod_mappings.append(vert_map)
-            self.current_lod_counts.append(len(final_verts))
-
-            # --- 3. WRITE DATA ---
-            f.write(struct.pack("<H", len(final_verts)))
-            for v in final_verts:
-                f.write(struct.pack("<3f", *v['pos']))
-                f.write(struct.pack("<3f", *v['norm']))
-                f.write(struct.pack("<2f", *v['uv']))
-            
-            f.write(struct.pack("<B", len(mat_groups)))
-            for mat_idx, faces in mat_groups.items():
-                f.write(struct.pack("<H", len(faces)))
-                for tri in faces:
-                    if len(tri) == 3:
-                        f.write(struct.pack("<3H", tri[0], tri[2], tri[1]))
-                
-                mat_id = 0
-                if mat_idx < len(lod_obj.material_slots):
-                    real_mat = lod_obj.material_slots[mat_idx].material
-                    if real_mat in self.materials:
-                        mat_id = self.materials.index(real_mat) + 1
+            # Face groups over the 16-bit triangle count are written as several groups
+            groups = [
+                (mat_id, tris[start:start + MAX_GROUP_TRIANGLES])
+                for mat_id, tris in geo['groups']
+                for start in range(0, max(len(tris), 1), MAX_GROUP_TRIANGLES)
+            ]
+            f.write(struct.pack("<B", len(groups)))
+            for mat_id, tris in groups:
+                f.write(struct.pack("<H", len(tris)))
+                f.write(tris[:, [0, 2, 1]].astype("<u2").tobytes())
                 f.write(struct.pack("<H", mat_id))
-            
-        return len(lods)
     
-    def serialize_frame(self, f, obj):
+    def classify_frame(self, obj):
         frame_type = FRAME_VISUAL
         visual_type = VISUAL_OBJECT
         
-        r_flag1 = getattr(obj, "render_flags", 128)
-        r_flag2 = getattr(obj, "render_flags2", 42)
-        visual_flags = (r_flag1, r_flag2)
-        
         if obj.type == "MESH":
-            if hasattr(obj, "visual_type"):
+            # visual_type is a registered property on every object, so detect the
+            # non-visual frames by name / display type first
+            if "sector" in obj.name.lower(): frame_type = FRAME_SECTOR
+            elif obj.display_type == "WIRE": frame_type = FRAME_OCCLUDER
+            else:
                 visual_type = int(obj.visual_type)
                 if visual_type in (VISUAL_SINGLEMESH, VISUAL_SINGLEMORPH):
                     has_arm = any(m.type == 'ARMATURE' and m.object for m in obj.modifiers)
                     if not has_arm: visual_type = VISUAL_OBJECT
-            else:
-                if obj.modifiers and any(mod.type == "ARMATURE" for mod in obj.modifiers):
-                    visual_type = VISUAL_SINGLEMORPH if obj.data.shape_keys else VISUAL_SINGLEMESH
-                elif "portal" in obj.name.lower(): pass 
-                elif "sector" in obj.name.lower(): frame_type = FRAME_SECTOR
-                elif obj.display_type == "WIRE": frame_type = FRAME_OCCLUDER
-                elif obj.data.shape_keys: visual_type = VISUAL_MORPH
         
         elif obj.type == "EMPTY":
             if obj.empty_display_type == "CUBE": frame_type = FRAME_DUMMY
             elif obj.empty_display_type == "PLAIN_AXES": frame_type = FRAME_TARGET
+        return frame_type, visual_type
+
+    def frame_fingerprint(self, obj, header):
+        """Cheap key of everything a visual frame body depends on (no geometry access)."""
+        parts = [
+            obj.name, header['frame_type'], header['visual_type'], header['visual_flags'],
+            header['pos'], header['rot'], header['scale'], header['cull_flags'], self.version, self.optimize_vcache,
+            (self.generate_lods, self.compute_lod_distances, self.lod_triangle_budget, self.lod_ratios,
+             self.lod_pixel_error, self.lod_fov, self.lod_screen_height),
+            self.cleanup_mesh and self.double_sided_ids,
+            self.weld_vertices and (self.weld_distance, self.weld_uv_distance, self.weld_angle),
+        ]
+        for lod_obj in self.lod_map.get(obj, [obj]):
+            data_ptr = lod_obj.data.as_pointer()
+            parts.append((
+                lod_obj.as_pointer(), data_ptr,
+                _update_ticks.get(lod_obj.as_pointer(), 0), _update_ticks.get(data_ptr, 0),
+                getattr(lod_obj, "ls3d_lod_dist", 0.0),
+                tuple(self.material_index.get(slot.material, 0) for slot in lod_obj.material_slots),
+                tuple(self.atlas_transforms.get(slot.material) for slot in lod_obj.material_slots),
+                # Deforming objects (armatures, hooks...) change the evaluated mesh too
+                tuple(_update_ticks.get(m.object.as_pointer(), 0) for m in lod_obj.modifiers if getattr(m, "object", None)),
+            ))
+        return tuple(parts)
+
+    def passthrough_range(self, obj, header):
+        """(source map, start, end) of this frame's body in the imported .4ds, if it can be copied verbatim."""
+        src = obj.get("ls3d_src_file")
+        if not src or header['visual_type'] not in (VISUAL_OBJECT, VISUAL_LITOBJECT, VISUAL_BILLBOARD):
+            return None
+        if self.cleanup_mesh or self.optimize_vcache or self.weld_vertices:
+            return None  # geometry passes would not be applied to copied bodies
+        if file_stamp(src) != obj.get("ls3d_src_stamp"):
+            return None
+        lods = self.lod_map.get(obj, [obj])
+        # Fan triangulation: loops - 2 * polygons triangles
+        if self.wants_generated_lods(header['visual_type'], lods, len(obj.data.loops) - 2 * len(obj.data.polygons)):
+            return None
+        if self.compute_lod_distances and len(lods) > 1:
+            return None  # recorded fade distances would be replaced
+        for lod_obj in lods:
+            if lod_obj.modifiers:
+                return None
+            # Material ids are baked into the body
+            for slot in lod_obj.material_slots:
+                mat = slot.material
+                if mat is None or mat.get("ls3d_src_file") != src or mat.get("ls3d_src_index") != self.material_index.get(mat):
+                    return None
+                if mat in self.atlas_transforms:
+                    return None
+        if frame_input_hash(obj, lods, header['visual_type']) != obj.get("ls3d_src_hash"):
+            return None
+
+        if src not in self.source_maps:
+            src_file = open(src, "rb")
+            self.source_maps[src] = (src_file, mmap.mmap(src_file.fileno(), 0, access=mmap.ACCESS_READ))
+        start, end = obj["ls3d_src_range"]
+        return self.source_maps[src][1], start, end
+
+    def refresh_passthrough(self, headers, encoded):
+        """Re-points passthrough records at the file just written if it replaced their source."""
+        out = source_path(self.filepath)
+        stamp = file_stamp(self.filepath)
+        for header, blobs in zip(headers, encoded):
+            obj = header['object']
+            if header['joint'] or obj is None or obj.get("ls3d_src_file") != out:
+                continue
+            if blobs.get('spliced'):
+                obj["ls3d_src_range"] = list(header['body_range'])
+                obj["ls3d_src_stamp"] = stamp
+            else:
+                for key in ("ls3d_src_file", "ls3d_src_range", "ls3d_src_stamp", "ls3d_src_hash"):
+                    if key in obj: del obj[key]
+        for mat, mat_id in self.material_index.items():
+            if mat.get("ls3d_src_file") == out:
+                mat["ls3d_src_index"] = mat_id
+
+    def wants_generated_lods(self, visual_type, lods, num_tris):
+        return (
+            self.generate_lods and len(lods) == 1
+            and visual_type in (VISUAL_OBJECT, VISUAL_LITOBJECT)
+            and num_tris > self.lod_triangle_budget
+        )
+
+    def generate_lod_snapshots(self, obj, base):
+        """Snapshots decimated LOD levels of obj (main thread only).
+
+        Each level is a temporary object with a Decimate modifier on a copy of the evaluated
+        mesh; everything is removed again afterwards. Fade distances come from the bounding
+        sphere: the level's tessellation error must project below lod_pixel_error pixels.
+        """
+        co = base['co']
+        if not len(co):
+            return []
+        center = (co.min(axis=0) + co.max(axis=0)) / 2
+        radius = float(np.linalg.norm(co - center, axis=1).max()) * max(obj.matrix_world.to_scale())
+        base_error = tessellation_error(radius, len(base['tri_slot']))
+
+        source_mesh = bpy.data.meshes.new_from_object(obj.evaluated_get(self.depsgraph))
+        temps = []
+        levels = []
+        try:
+            for ratio in self.lod_ratios:
+                if not 0.0 < ratio < 1.0:
+                    continue
+                temp = bpy.data.objects.new(f"{obj.name}_ls3d_lod_tmp", source_mesh)
+                bpy.context.scene.collection.objects.link(temp)
+                modifier = temp.modifiers.new("LS3D Decimate", 'DECIMATE')
+                modifier.ratio = ratio
+                temps.append(temp)
+            if temps:
+                # Evaluate the new modifiers
+                self.depsgraph = bpy.context.evaluated_depsgraph_get()
+
+            num_tris = len(base['tri_slot'])
+            for temp in temps:
+                snap = self.snapshot_lod(temp)
+                if len(snap['tri_slot']) >= num_tris:
+                    continue  # no reduction over the previous level
+                num_tris = len(snap['tri_slot'])
+                error = tessellation_error(radius, num_tris) - base_error
+                snap['dist'] = lod_distance_for_error(error, self.lod_pixel_error, self.lod_fov, self.lod_screen_height)
+                # Object-linked materials live on obj, not on the temporary object
+                snap['slot_mat_ids'] = base['slot_mat_ids']
+                snap['slot_uv_transforms'] = base['slot_uv_transforms']
+                levels.append(snap)
+        finally:
+            for temp in temps:
+                bpy.data.objects.remove(temp)
+            bpy.data.meshes.remove(source_mesh)
+
+        self.generated_lod_count += len(levels)
+        self.log(f"  {obj.name}: generated {len(levels)} LODs ({', '.join(str(len(s['tri_slot'])) for s in levels)} triangles)")
+        return levels
+
+    def collect_static_batches(self):
+        """Groups static visual objects directly under the same sector (or the scene root) that can
+        be merged into one frame. Objects with collision, user props, animation, children, LODs,
+        parent bones or modifiers driven by other objects or the frame stay separate.
+        """
+        exported = set(self.objects)
+        batches = {}
+        for obj in self.objects:
+            if obj.type != 'MESH' or obj in self.children_map:
+                continue
+            frame_type, visual_type = self.classify_frame(obj)
+            if frame_type != FRAME_VISUAL or visual_type not in (VISUAL_OBJECT, VISUAL_LITOBJECT):
+                continue
+            if getattr(obj, "ls3d_user_props", "") or getattr(obj, "cull_flags", 128) & CULL_COLLISION_MASK:
+                continue
+            if obj.animation_data or len(self.lod_map.get(obj, [obj])) > 1:
+                continue
+            if is_deformed(obj) or obj.parent_type == 'BONE':
+                continue
+            parent = obj.parent if obj.parent in exported else None
+            if parent is not None and "sector" not in parent.name.lower():
+                continue
+            key = (
+                parent, visual_type, getattr(obj, "render_flags", 128), getattr(obj, "render_flags2", 42),
+                getattr(obj, "cull_flags", 128), getattr(obj, "ls3d_lod_dist", 0.0),
+            )
+            batches.setdefault(key, []).append(obj)
+        return [(key, objs) for key, objs in batches.items() if len(objs) > 1]
+
+    def snapshot_batch(self, name, key, objs):
+        """One combined frame for a static batch, in the space of the shared parent (main thread only)."""
+        parent, visual_type, r_flag1, r_flag2, cull_flags, _ = key
+        header = {
+            'object': None,
+            'joint': False,
+            # Never derived from the parent: a sector name would make the batch a sector on re-import
+            'name': name,
+            'parent': parent,
+            'parent_bone': "",
+            'frame_type': FRAME_VISUAL,
+            'visual_type': visual_type,
+            'visual_flags': (r_flag1, r_flag2),
+            'pos': (0.0, 0.0, 0.0),
+            'rot': (1.0, 0.0, 0.0, 0.0),
+            'scale': (1.0, 1.0, 1.0),
+            'cull_flags': cull_flags,
+            'user_props': "",
+            'instanceable': False,
+        }
+        to_parent = parent.matrix_world.inverted() if parent else Matrix.Identity(4)
+        snaps = []
+        for obj in objs:
+            snap = self.snapshot_lod(obj)
+            self.batch_draw_calls += snapshot_draw_calls(snap)
+            snaps.append((snap, np.array(to_parent @ obj.matrix_world, dtype=np.float64)))
+        data = {
+            'name': header['name'], 'visual_type': visual_type, 'lods': [merge_lod_snapshots(snaps)],
+            'skin': None, 'morph': None, 'body': b"",
+        }
+        return header, data
+
+    def snapshot_frame(self, obj):
+        """Reads everything one frame needs from Blender (main thread only).
+
+        Returns (header, data): header fields are packed at write time once frame ids are
+        known, data is handed to encode_frame() on a worker thread.
+        """
+        frame_type, visual_type = self.classify_frame(obj)
         
-        parent_id = 0
-        if obj.parent:
-            if obj.parent_type == 'BONE' and obj.parent_bone:
-                parent_id = self.joint_map.get(obj.parent_bone, 0)
-            elif obj.parent in self.frames_map:
-                parent_id = self.frames_map[obj.parent]
-        
-        self.frames_map[obj] = self.frame_index
-        self.frame_index += 1
+        r_flag1 = getattr(obj, "render_flags", 128)
+        r_flag2 = getattr(obj, "render_flags2", 42)
         
-        if obj.parent and obj.parent_type != 'BONE':
+        # A parent outside the export writes this frame as a root, so it needs its world transform
+        if obj.parent not in self.frame_parents:
+             matrix = obj.matrix_world
+        elif obj.parent_type != 'BONE':
              matrix = obj.parent.matrix_world.inverted() @ obj.matrix_world
-        elif obj.parent and obj.parent_type == 'BONE':
+        else:
              arm = obj.parent
              bone = arm.data.bones[obj.parent_bone]
              bone_world = arm.matrix_world @ bone.matrix_local
              matrix = bone_world.inverted() @ obj.matrix_world
-        else:
-             matrix = obj.matrix_world
-             
-        pos = matrix.to_translation()
-        rot = matrix.to_quaternion()
-        scale = matrix.to_scale()
-        
-        f.write(struct.pack("<B", frame_type))
-        if frame_type == FRAME_VISUAL:
-            f.write(struct.pack("<B", visual_type))
-            f.write(struct.pack("<2B", *visual_flags))
-            
-        f.write(struct.pack("<H", parent_id))
-        f.write(struct.pack("<3f", pos.x, pos.z, pos.y))
-        f.write(struct.pack("<3f", scale.x, scale.z, scale.y))
-        f.write(struct.pack("<4f", rot.w, rot.x, rot.z, rot.y))
-        f.write(struct.pack("<B", getattr(obj, "cull_flags", 128)))
-        self.write_string(f, obj.name)
-        self.write_string(f, getattr(obj, "ls3d_user_props", ""))
-        
+
+        header = {
+            'object': obj,
+            'joint': False,
+            'name': obj.name,
+            'parent': obj.parent,
+            'parent_bone': obj.parent_bone if obj.parent and obj.parent_type == 'BONE' else "",
+            'frame_type': frame_type,
+            'visual_type': visual_type,
+            'visual_flags': (r_flag1, r_flag2),
+            'pos': matrix.to_translation()[:],
+            'rot': matrix.to_quaternion()[:],
+            'scale': matrix.to_scale()[:],
+            'cull_flags': getattr(obj, "cull_flags", 128),
+            'user_props': getattr(obj, "ls3d_user_props", ""),
+        }
+
+        # Plain objects can reference the geometry of an earlier frame (instance_id)
+        header['instanceable'] = self.use_instancing and frame_type == FRAME_VISUAL and visual_type in (VISUAL_OBJECT, VISUAL_LITOBJECT)
+        if header['instanceable']:
+            lods = self.lod_map.get(obj, [obj])
+            if not any(lod_obj.modifiers for lod_obj in lods):
+                # Shared mesh data without modifiers: same geometry, skip snapshot and encode
+                key = tuple(
+                    (lod_obj.data.as_pointer(), getattr(lod_obj, "ls3d_lod_dist", 0.0),
+                     tuple(self.material_index.get(slot.material, 0) for slot in lod_obj.material_slots))
+                    for lod_obj in lods
+                )
+                # Generated and computed LOD distances grow with the object's scale
+                if self.generate_lods or self.compute_lod_distances:
+                    key += (round(max(obj.matrix_world.to_scale()), 4),)
+                if key in self.shared_meshes:
+                    return header, {'instance_of': self.shared_meshes[key]}
+                self.shared_meshes[key] = obj
+
+        if frame_type == FRAME_VISUAL and self.use_cache:
+            header['fingerprint'] = self.frame_fingerprint(obj, header)
+            cached = _frame_cache.get(obj.as_pointer())
+            if cached and cached[0] == header['fingerprint']:
+                self.cache_hits += 1
+                return header, {'cached': cached[1]}
+
+        if frame_type == FRAME_VISUAL and self.use_passthrough:
+            splice = self.passthrough_range(obj, header)
+            if splice:
+                self.passthrough_count += 1
+                return header, {'splice': splice}
+
+        data = {'name': obj.name, 'visual_type': visual_type, 'lods': None, 'skin': None, 'morph': None}
+        body = io.BytesIO()
         if frame_type == FRAME_VISUAL:
             lods = self.lod_map.get(obj, [obj])
-            num = self.serialize_object(f, obj, lods)
+            data['lods'] = [self.snapshot_lod(lod_obj) for lod_obj in lods]
+            if self.wants_generated_lods(visual_type, lods, len(data['lods'][0]['tri_slot'])):
+                data['lods'] += self.generate_lod_snapshots(obj, data['lods'][0])
+            if self.compute_lod_distances and len(data['lods']) > 1:
+                levels = [(lod['co'].astype(np.float64), lod['loop_vi'][lod['tri_loops']]) for lod in data['lods']]
+                scale = max(obj.matrix_world.to_scale())
+                distances = lod_chain_distances(levels, scale, self.lod_pixel_error, self.lod_fov, self.lod_screen_height)
+                for lod, dist in zip(data['lods'][1:], distances):
+                    lod['dist'] = dist
+            num = len(lods)
             
             if visual_type == VISUAL_BILLBOARD:
-                self.serialize_billboard(f, obj)
+                self.serialize_billboard(body, obj)
             elif visual_type == VISUAL_MIRROR:
-                self.serialize_mirror(f, obj)
+                self.serialize_mirror(body, obj)
             elif visual_type == VISUAL_SINGLEMESH:
-                self.serialize_singlemesh(f, obj, num)
+                data['skin'] = self.snapshot_skin(obj, num)
             elif visual_type == VISUAL_SINGLEMORPH:
-                self.serialize_singlemesh(f, obj, num)
-                self.serialize_morph(f, obj, num)
+                data['skin'] = self.snapshot_skin(obj, num)
+                data['morph'] = self.snapshot_morph(obj, num)
             elif visual_type == VISUAL_MORPH:
-                self.serialize_morph(f, obj, num)
+                data['morph'] = self.snapshot_morph(obj, num)
 
         elif frame_type == FRAME_SECTOR:
-            self.serialize_sector(f, obj)
+            self.serialize_sector(body, obj)
         elif frame_type == FRAME_DUMMY:
-            self.serialize_dummy(f, obj)
+            self.serialize_dummy(body, obj)
         elif frame_type == FRAME_TARGET:
-            self.serialize_target(f, obj)
+            self.serialize_target(body, obj)
         elif frame_type == FRAME_OCCLUDER:
-            self.serialize_occluder(f, obj)
+            self.serialize_occluder(body, obj)
+        data['body'] = body.getvalue()
+        return header, data
+
+    def encode_frame(self, data):
+        """Turns a frame snapshot into byte blobs (runs on worker threads, no bpy access)."""
+        if 'cached' in data:
+            return data['cached']
+        if 'instance_of' in data:
+            return {'object': None, 'tail': b"", 'instance_of': data['instance_of']}
+        if 'splice' in data:
+            source, start, end = data['splice']
+            return {'object': None, 'tail': source[start:end], 'spliced': True}
+        if data['lods'] is None:
+            return {'object': None, 'tail': data['body']}
+
+        geos = [self.build_lod_geometry(lod) for lod in data['lods']]
+        welded = None
+        if self.weld_vertices:
+            same_source = data['skin'] is not None or data['morph'] is not None
+            welded = sum(self.weld_lod_geometry(geo, same_source) for geo in geos)
+        cleanup = None
+        if self.cleanup_mesh:
+            cleanup = tuple(map(sum, zip(*[self.cleanup_lod_geometry(geo) for geo in geos])))
+        parts = [geos]
+        if any(len(geo['positions']) > MAX_VERTICES for geo in geos):
+            counts = ", ".join(str(len(geo['positions'])) for geo in geos)
+            if data['visual_type'] not in (VISUAL_OBJECT, VISUAL_LITOBJECT):
+                # Bone tables, morph blocks and billboard/mirror data cannot be spread over frames
+                raise ExportError(f"{data['name']}: {counts} vertices per LOD exceed the {MAX_VERTICES} vertex limit and this visual type cannot be split")
+            parts = self.split_lod_geometry(geos)
+            geos = parts[0]
+
+        if data['morph'] is not None and data['morph']['num_targets']:
+            self.check_vertex_sources(data['name'], geos, [len(lod['basis']) for lod in data['morph']['lods']], "shape keys")
+        skin_tables = None
+        if data['skin'] is not None:
+            self.check_vertex_sources(data['name'], geos, [len(table['owner']) for table in data['skin']['tables']], "bone weights")
+            num_bones = len(data['skin']['inv_binds'])
+            skin_tables = [self.skin_lod_geometry(geo, table, num_bones) for geo, table in zip(geos, data['skin']['tables'])]
+
+        vcache = None
+        if self.optimize_vcache:
+            # Skinned vertices must keep their bone order, bone tables refer to it
+            stats = [self.optimize_lod_geometry(geo, renumber=data['skin'] is None) for part in parts for geo in part]
+            vcache = tuple(map(sum, zip(*stats)))
+        blocks = []
+        for part in parts:
+            f = io.BytesIO()
+            self.encode_object(f, part)
+            blocks.append(f.getvalue())
+        object_block = blocks[0]
+
+        # Type specific data follows the object block
+        f = io.BytesIO()
+        f.write(data['body'])
+        if data['skin'] is not None:
+            self.encode_singlemesh(f, data['skin'], skin_tables)
+        if data['morph'] is not None:
+            self.encode_morph(f, data['morph'], geos)
+        encoded = {
+            'object': object_block, 'tail': f.getvalue(), 'vcache': vcache, 'cleanup': cleanup, 'welded': welded,
+            'draw_calls': sum(len(part[0]['groups']) for part in parts),
+        }
+        if data['skin'] is not None:
+            encoded['skin_clamped'] = sum(table['clamped'] for table in data['skin']['tables'])
+        if len(parts) > 1:
+            encoded['parts'] = blocks[1:]
+            encoded['split'] = [len(part[0]['positions']) for part in parts]
+        return encoded
+
+    def resolve_parent_id(self, header):
+        if header['joint']:
+            if header['parent_bone']:
+                return self.joint_map.get(header['parent_bone'], 0)
+            # Root bone connects to Armature's parent
+            return self.frames_map.get(header['parent'], 0)
+        if header['parent'] is None:
+            return 0
+        if header['parent_bone']:
+            return self.joint_map.get(header['parent_bone'], 0)
+        return self.frames_map.get(header['parent'], 0)
+
+    def write_frame(self, f, header, encoded):
+        parent_id = self.resolve_parent_id(header)
+        frame_id = self.frame_index
+        
+        # Register this frame
+        if header['joint']:
+            self.joint_map[header['name']] = self.frame_index
+        else:
+            self.frames_map[header['object']] = self.frame_index
+        self.frame_index += 1
+
+        self.write_frame_header(f, header, parent_id)
+
+        # Instancing: geometry identical to an earlier frame is replaced by its frame id
+        object_block = encoded['object']
+        if header.get('instanceable'):
+            source_id = self.instance_targets.get(encoded.get('instance_of'))
+            if source_id is None and object_block is not None:
+                source_id = self.instance_blocks.get(object_block)
+            if source_id is not None:
+                object_block = struct.pack("<H", source_id)
+                self.instance_count += 1
+            elif object_block is not None:
+                self.instance_blocks[object_block] = frame_id
+            self.instance_targets[header['object']] = source_id or frame_id
+
+        body_start = f.tell()
+        if object_block is not None:
+            f.write(object_block)
+        f.write(encoded['tail'])
+        header['body_range'] = (body_start, f.tell())
+
+        # Extra parts of a split mesh: child frames with identity transform
+        part_ids = []
+        part_blocks = encoded.get('parts', ())
+        if 'instance_of' in encoded:
+            part_blocks = [struct.pack("<H", part_id) for part_id in self.split_parts.get(encoded['instance_of'], ())]
+        for k, block in enumerate(part_blocks, start=1):
+            part_id = self.frame_index
+            self.frame_index += 1
+            part_header = dict(header, name=f"{header['name']}_part{k}", user_props="",
+                               pos=(0.0, 0.0, 0.0), rot=(1.0, 0.0, 0.0, 0.0), scale=(1.0, 1.0, 1.0))
+            self.write_frame_header(f, part_header, frame_id)
+            if self.use_instancing and len(block) > 2:
+                if block in self.instance_blocks:
+                    part_id = self.instance_blocks[block]
+                    block = struct.pack("<H", part_id)
+                else:
+                    self.instance_blocks[block] = part_id
+            f.write(block)
+            part_ids.append(part_id)
+        if part_ids:
+            self.split_parts[header['object']] = part_ids
+
+    def write_frame_header(self, f, header, parent_id):
+        pos, rot, scale = header['pos'], header['rot'], header['scale']
+        f.write(struct.pack("<B", header['frame_type']))
+        if header['frame_type'] == FRAME_VISUAL:
+            f.write(struct.pack("<B", header['visual_type']))
+            f.write(struct.pack("<2B", *header['visual_flags']))
+            
+        f.write(struct.pack("<H", parent_id))
+        f.write(struct.pack("<3f", pos[0], pos[2], pos[1]))
+        f.write(struct.pack("<3f", scale[0], scale[2], scale[1]))
+        f.write(struct.pack("<4f", rot[0], rot[1], rot[3], rot[2]))
+        f.write(struct.pack("<B", header['cull_flags']))
+        self.write_string(f, header['name'])
+        self.write_string(f, header['user_props'])
+        self.frame_names.append(header['name'])
 
     def serialize_billboard(self, f, obj):
         # Enum is '0','1','2' string. File needs 1-based index integer.
@@ -936,19 +3074,38 @@ class The4DSExporter:
         f.write(struct.pack("<B", mode))
 
     def serialize_mirror(self, f, obj):
+        mesh = obj.data
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get("co", co)
+        co = co.reshape(-1, 3)[:, [0, 2, 1]]  # file space (Y up)
+
         # Bounds
-        min_b = getattr(obj, "bbox_min", (-1,-1,-1))
-        max_b = getattr(obj, "bbox_max", (1,1,1))
-        f.write(struct.pack("<3f", min_b[0], min_b[2], min_b[1]))
-        f.write(struct.pack("<3f", max_b[0], max_b[2], max_b[1]))
+        min_b = co.min(axis=0) if len(co) else np.zeros(3)
+        max_b = co.max(axis=0) if len(co) else np.zeros(3)
+        stored_min, stored_max = getattr(obj, "bbox_min", (0,0,0)), getattr(obj, "bbox_max", (0,0,0))
+        self.check_bounds(obj, stored_min, stored_max, min_b[[0, 2, 1]], max_b[[0, 2, 1]])
+        f.write(struct.pack("<3f", *min_b))
+        f.write(struct.pack("<3f", *max_b))
         
         # Center/Radius
-        f.write(struct.pack("<3f", 0,0,0)) 
-        f.write(struct.pack("<f", 10.0))
+        center, radius = bounding_sphere(co)
+        f.write(struct.pack("<3f", *center)) 
+        f.write(struct.pack("<f", radius))
         
-        # Matrix (Identity)
-        m = [1,0,0,0, 0,1,0,0, 0,0,1,0, 0,0,0,1]
-        f.write(struct.pack("<16f", *m))
+        # Matrix: reflection across the mirror plane (row-major, translation in the last row)
+        m = np.identity(4)
+        if len(mesh.polygons):
+            normals = np.empty(len(mesh.polygons) * 3, dtype=np.float64)
+            mesh.polygons.foreach_get("normal", normals)
+            areas = np.empty(len(mesh.polygons), dtype=np.float64)
+            mesh.polygons.foreach_get("area", areas)
+            normal = (normals.reshape(-1, 3) * areas[:, None]).sum(axis=0)[[0, 2, 1]]
+            length = np.linalg.norm(normal)
+            if length > 1e-12:
+                normal /= length
+                m[:3, :3] -= 2.0 * np.outer(normal, normal)
+                m[3, :3] = 2.0 * float(normal @ co.mean(axis=0)) * normal
+        f.write(struct.pack("<16f", *m.reshape(-1)))
         
         # Color
         col = getattr(obj, "mirror_color", (0,0,0))
@@ -960,14 +3117,16 @@ class The4DSExporter:
         # Mesh
         mesh = obj.data
         bm = bmesh.new()
-        bm.from_mesh(mesh)
-        f.write(struct.pack("<I", len(bm.verts)))
-        f.write(struct.pack("<I", len(bm.faces)))
-        for v in bm.verts:
-            f.write(struct.pack("<3f", v.co.x, v.co.z, v.co.y))
-        for face in bm.faces:
-            f.write(struct.pack("<3H", face.verts[0].index, face.verts[2].index, face.verts[1].index))
-        bm.free()
+        try:
+            bm.from_mesh(mesh)
+            f.write(struct.pack("<I", len(bm.verts)))
+            f.write(struct.pack("<I", len(bm.faces)))
+            for v in bm.verts:
+                f.write(struct.pack("<3f", v.co.x, v.co.z, v.co.y))
+            for face in bm.faces:
+                f.write(struct.pack("<3H", face.verts[0].index, face.verts[2].index, face.verts[1].index))
+        finally:
+            bm.free()
 
     def serialize_sector(self, f, obj):
         # Flags
@@ -978,106 +3137,104 @@ class The4DSExporter:
         # Mesh
         mesh = obj.data
         bm = bmesh.new()
-        bm.from_mesh(mesh)
-        bm.verts.ensure_lookup_table()
-        
-        f.write(struct.pack("<I", len(bm.verts)))
-        f.write(struct.pack("<I", len(bm.faces)))
-        
-        for vert in bm.verts:
-            f.write(struct.pack("<3f", vert.co.x, vert.co.z, vert.co.y))
-        for face in bm.faces:
-            f.write(struct.pack("<3H", face.verts[0].index, face.verts[2].index, face.verts[1].index))
+        try:
+            bm.from_mesh(mesh)
+            bm.verts.ensure_lookup_table()
+            if len(bm.verts) > MAX_VERTICES:
+                raise ExportError(f"{obj.name}: sector has {len(bm.verts)} vertices, the limit is {MAX_VERTICES} (sectors cannot be split)")
             
-        # Bounds
-        min_b = getattr(obj, "bbox_min", (0,0,0))
-        max_b = getattr(obj, "bbox_max", (0,0,0))
+            f.write(struct.pack("<I", len(bm.verts)))
+            f.write(struct.pack("<I", len(bm.faces)))
+            
+            for vert in bm.verts:
+                f.write(struct.pack("<3f", vert.co.x, vert.co.z, vert.co.y))
+            for face in bm.faces:
+                f.write(struct.pack("<3H", face.verts[0].index, face.verts[2].index, face.verts[1].index))
+        finally:
+            bm.free()
+            
+        # Bounds of the hull that was just written
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get("co", co)
+        co = co.reshape(-1, 3)
+        min_b = co.min(axis=0) if len(co) else np.zeros(3)
+        max_b = co.max(axis=0) if len(co) else np.zeros(3)
+        self.check_bounds(obj, getattr(obj, "bbox_min", (0,0,0)), getattr(obj, "bbox_max", (0,0,0)), min_b, max_b)
         f.write(struct.pack("<3f", min_b[0], min_b[2], min_b[1]))
         f.write(struct.pack("<3f", max_b[0], max_b[2], max_b[1]))
         
         # Portals
-        portals = [c for c in obj.children if "portal" in c.name.lower() or "plane" in c.name.lower()]
+        portals = [c for c in obj.children if is_portal(c)]
         f.write(struct.pack("<B", len(portals)))
         
         for p_obj in portals:
             self.serialize_portal(f, p_obj)
-        
-        bm.free()
 
     def serialize_portal(self, f, obj):
         mesh = obj.data
         bm = bmesh.new()
-        bm.from_mesh(mesh)
-        
-        f.write(struct.pack("<B", len(bm.verts)))
-        
-        # Flags, Near, Far
-        f.write(struct.pack("<I", getattr(obj, "ls3d_portal_flags", 4)))
-        f.write(struct.pack("<f", getattr(obj, "ls3d_portal_near", 0.0)))
-        f.write(struct.pack("<f", getattr(obj, "ls3d_portal_far", 100.0)))
-        
-        # Normal
-        norm = obj.matrix_world.to_quaternion() @ Vector((0,0,1))
-        f.write(struct.pack("<3f", norm.x, norm.z, norm.y))
-        f.write(struct.pack("<f", 0.0)) # Dot
-        
-        for v in bm.verts:
-            f.write(struct.pack("<3f", v.co.x, v.co.z, v.co.y))
+        try:
+            bm.from_mesh(mesh)
             
-        bm.free()
+            f.write(struct.pack("<B", len(bm.verts)))
+            
+            # Flags, Near, Far
+            f.write(struct.pack("<I", getattr(obj, "ls3d_portal_flags", 4)))
+            f.write(struct.pack("<f", getattr(obj, "ls3d_portal_near", 0.0)))
+            f.write(struct.pack("<f", getattr(obj, "ls3d_portal_far", 100.0)))
+            
+            # Plane from the outline itself (Newell), object rotation only for degenerate outlines
+            points = np.array([v.co for v in bm.verts], dtype=np.float64).reshape(-1, 3)
+            norm = newell_normal(points) if len(points) >= 3 else np.zeros(3)
+            if not norm.any():
+                norm = np.array(obj.matrix_world.to_quaternion() @ Vector((0,0,1)))
+            dot = -float(norm @ points[0]) if len(points) else 0.0
+            f.write(struct.pack("<3f", norm[0], norm[2], norm[1]))
+            f.write(struct.pack("<f", dot))
+            
+            for v in bm.verts:
+                f.write(struct.pack("<3f", v.co.x, v.co.z, v.co.y))
+        finally:
+            bm.free()
     
-    def serialize_joints(self, f, armature):
+    def snapshot_joints(self, armature):
         # We don't write the Armature Object itself as a frame, 
         # but we need to pass its hierarchy context.
         # Parent ID for the root bone is the Armature's parent (if any).
-        
-        arm_parent_id = 0
-        if armature.parent:
-             arm_parent_id = self.frames_map.get(armature.parent, 0)
-        
-        # Iterate bones
-        for bone in armature.data.bones:
-            frame_type = FRAME_JOINT
-            
-            # Determine Parent ID
-            if bone.parent:
-                parent_id = self.joint_map.get(bone.parent.name, 0)
-            else:
-                # Root bone connects to Armature's parent
-                parent_id = arm_parent_id
-            
-            # Register this bone
-            self.joint_map[bone.name] = self.frame_index
-            self.frame_index += 1
-            
+        frames = []
+        for bone_idx, bone in enumerate(armature.data.bones):
             # Calculate Transform
             if bone.parent:
                 matrix = bone.parent.matrix_local.inverted() @ bone.matrix_local
             else:
                 matrix = bone.matrix_local
             
-            pos = matrix.to_translation()
-            rot = matrix.to_quaternion()
-            scale = matrix.to_scale()
-            
-            f.write(struct.pack("<B", frame_type))
-            f.write(struct.pack("<H", parent_id))
-            f.write(struct.pack("<3f", pos.x, pos.z, pos.y))
-            f.write(struct.pack("<3f", scale.x, scale.z, scale.y))
-            f.write(struct.pack("<4f", rot.w, rot.x, rot.z, rot.y))
-            f.write(struct.pack("<B", 0)) # Joint flags (unused?)
-            self.write_string(f, bone.name)
-            self.write_string(f, "") # User props
+            header = {
+                'object': armature,
+                'joint': True,
+                'name': bone.name,
+                'parent': armature.parent,
+                'parent_bone': bone.parent.name if bone.parent else "",
+                'frame_type': FRAME_JOINT,
+                'pos': matrix.to_translation()[:],
+                'rot': matrix.to_quaternion()[:],
+                'scale': matrix.to_scale()[:],
+                'cull_flags': 0, # Joint flags (unused?)
+                'user_props': "",
+            }
             
             # Joint Body
-            self.serialize_joint(f, bone, armature, parent_id)
+            body = io.BytesIO()
+            self.serialize_joint(body, bone, bone_idx)
+            frames.append((header, {'lods': None, 'body': body.getvalue()}))
+        return frames
             
     def collect_lods(self):
         self.lod_map = {}
         all_lod_objects = set()
         
         base_objects = [o for o in self.objects_to_export if o.type == "MESH" and "_lod" not in o.name]
-        scene_objects = bpy.context.scene.objects
+        scene_objects = {o.name: o for o in bpy.context.scene.objects}
         
         for base_obj in base_objects:
             self.lod_map[base_obj] = [base_obj]
@@ -1100,66 +3257,402 @@ class The4DSExporter:
         return all_lod_objects
     
     def serialize_file(self):
+        all_materials = self.collect_materials()
+        if self.dedup_materials:
+            self.materials, self.material_blobs, self.material_index = self.merge_materials(all_materials)
+            if len(self.materials) < len(all_materials):
+                self.log(f"Merged {len(all_materials) - len(self.materials)} duplicate materials")
+        else:
+            self.materials = all_materials
+            self.material_index = {mat: i + 1 for i, mat in enumerate(self.materials)}
+            self.material_blobs = None
+        self.atlas_transforms = {}
+        if self.atlas_textures:
+            self.build_atlases()
+        self.double_sided_ids = frozenset(i + 1 for i, mat in enumerate(self.materials) if getattr(mat, "ls3d_diff_2sided", False))
+        
+        lod_objects_set = self.collect_lods()
+        
+        # SAFE CHECK: Use object names to check existence in scene
+        scene_names = set(o.name for o in bpy.context.scene.objects)
+        
+        raw_objects = [
+            obj for obj in self.objects_to_export
+            if obj.name in scene_names 
+            and obj not in lod_objects_set
+            and not is_portal(obj)
+            and obj.type in ("MESH", "EMPTY", "ARMATURE")
+        ]
+        
+        # HIERARCHY SORT
+        # Parent -> children index built once (obj.children scans the whole scene)
+        raw_set = set(raw_objects)
+        self.frame_parents = raw_set
+        self.children_map = {}
+        for o in raw_objects:
+            if o.parent in raw_set:
+                self.children_map.setdefault(o.parent, []).append(o)
+        for children in self.children_map.values():
+            children.sort(key=lambda x: x.name)
+        roots = [o for o in raw_objects if o.parent not in raw_set]
+        roots.sort(key=lambda x: x.name)
+
+        # Iterative pre-order walk (same order as the old recursive sort)
+        self.objects = []
+        seen = set()
+        stack = roots[::-1]
+        while stack:
+            obj = stack.pop()
+            if obj in seen: continue
+            seen.add(obj)
+            self.objects.append(obj)
+            stack.extend(reversed(self.children_map.get(obj, ())))
+        
+        leftovers = [o for o in raw_objects if o not in seen]
+        self.objects.extend(leftovers)
+
+        # Static batches are written after all regular frames, so their parents already exist
+        batches = self.collect_static_batches() if self.batch_static else []
+        batched = {obj for _, objs in batches for obj in objs}
+        if batched:
+            self.objects = [o for o in self.objects if o not in batched]
+        self.batch_draw_calls = 0
+
+        # One evaluated depsgraph for the whole export
+        self.depsgraph = bpy.context.evaluated_depsgraph_get()
+        self.temp_mesh_bytes = 0
+        self.peak_temp_mesh_bytes = 0
+        self.cache_hits = 0
+        self.passthrough_count = 0
+        self.instance_count = 0
+        self.generated_lod_count = 0
+        self.bounds_mismatches = []
+        self.shared_meshes = {}
+        self.instance_targets = {}
+        self.instance_blocks = {}
+        self.split_parts = {}
+
+        # Stage 1 (main thread): snapshot Blender data into arrays.
+        # Stage 2 (worker pool): encode snapshots into byte blobs while stage 1 continues.
+        headers = []
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.threads or None) as pool:
+                for obj in self.objects:
+                    if obj.type == "ARMATURE":
+                        frames = self.snapshot_joints(obj)
+                    else:
+                        frames = [self.snapshot_frame(obj)]
+                    for header, data in frames:
+                        headers.append(header)
+                        futures.append(pool.submit(self.encode_frame, data))
+                taken = {header['name'] for header in headers}
+                index = 0
+                for key, objs in batches:
+                    index += 1
+                    while f"static_batch{index}" in taken:
+                        index += 1
+                    header, data = self.snapshot_batch(f"static_batch{index}", key, objs)
+                    headers.append(header)
+                    futures.append(pool.submit(self.encode_frame, data))
+                encoded = [future.result() for future in futures]
+        finally:
+            self.depsgraph = None
+            # Source files must be released before the output (possibly the same file) is opened
+            for src_file, source in self.source_maps.values():
+                source.close()
+                src_file.close()
+            self.source_maps = {}
+
+        for header, blobs in zip(headers, encoded):
+            if header.get('fingerprint') is not None:
+                _frame_cache[header['object'].as_pointer()] = (header['fingerprint'], blobs)
+
+        # Split meshes add one child frame per extra part (instances repeat their source's parts)
+        part_counts = {}
+        for header, blobs in zip(headers, encoded):
+            if blobs.get('split'):
+                part_counts[header['object']] = len(blobs['parts'])
+                self.log(f"Split {header['name']} into {len(blobs['split'])} frames ({', '.join(map(str, blobs['split']))} vertices in LOD0)")
+        extra_frames = sum(len(blobs.get('parts', ())) or part_counts.get(blobs.get('instance_of'), 0) for blobs in encoded)
+
+        # Blobs are concatenated in frame order, frame ids are assigned here
+        total_frames = len(headers) + extra_frames
+        if total_frames > 65535:
+            raise ExportError(f"{total_frames} frames exceed the 65535 frame limit")
         with open(self.filepath, "wb") as f:
             self.serialize_header(f)
             
-            self.materials = self.collect_materials()
             f.write(struct.pack("<H", len(self.materials)))
             for i, mat in enumerate(self.materials):
-                self.serialize_material(f, mat, i + 1)
-            
-            lod_objects_set = self.collect_lods()
-            
-            # SAFE CHECK: Use object names to check existence in scene
-            scene_names = set(o.name for o in bpy.context.scene.objects)
-            
-            raw_objects = [
-                obj for obj in self.objects_to_export
-                if obj.name in scene_names 
-                and obj not in lod_objects_set
-                and obj.type in ("MESH", "EMPTY", "ARMATURE")
-            ]
-            
-            # HIERARCHY SORT
-            self.objects = []
-            roots = [o for o in raw_objects if (not o.parent) or (o.parent not in raw_objects)]
-            roots.sort(key=lambda x: x.name)
-
-            def sort_hierarchy(obj):
-                if obj in self.objects: return 
-                self.objects.append(obj)
-                children = [c for c in obj.children if c in raw_objects]
-                children.sort(key=lambda x: x.name)
-                for child in children:
-                    sort_hierarchy(child)
-
-            for root in roots:
-                sort_hierarchy(root)
-            
-            seen = set(self.objects)
-            leftovers = [o for o in raw_objects if o not in seen]
-            self.objects.extend(leftovers)
-
-            armatures = [obj for obj in self.objects if obj.type == "ARMATURE"]
-            visual_frames = [obj for obj in self.objects if obj.type != "ARMATURE"]
-            
-            bone_count = sum(len(arm.data.bones) for arm in armatures)
-            total_frames = len(visual_frames) + bone_count
+                if self.material_blobs:
+                    f.write(self.material_blobs[i])
+                else:
+                    self.serialize_material(f, mat, i + 1)
             
             f.write(struct.pack("<H", total_frames))
             
             self.frame_index = 1
             self.frames_map = {} 
             self.joint_map = {}
+            self.frame_names = []
             
-            for obj in self.objects:
-                if obj.type == "ARMATURE":
-                    self.serialize_joints(f, obj)
-                else:
-                    self.serialize_frame(f, obj)
+            for header, blobs in zip(headers, encoded):
+                self.write_frame(f, header, blobs)
                 
             f.write(struct.pack("<?", False))
 
+        self.refresh_passthrough(headers, encoded)
+
+        if batches:
+            batch_frames = sum(1 + len(blobs.get('parts', ())) for header, blobs in zip(headers, encoded) if header['object'] is None and not header['joint'])
+            draw_calls = sum(blobs.get('draw_calls', 0) for header, blobs in zip(headers, encoded) if header['object'] is None and not header['joint'])
+            self.log(f"Static batching: {len(batched)} objects -> {batch_frames} frames "
+                     f"({total_frames + len(batched) - batch_frames} -> {total_frames} frames total), "
+                     f"draw calls {self.batch_draw_calls} -> {draw_calls}")
+
+        if self.weld_vertices:
+            total = 0
+            for header, blobs in zip(headers, encoded):
+                if blobs.get('welded'):
+                    print(f"  {header['name']}: welded away {blobs['welded']} vertices")
+                    total += blobs['welded']
+            self.log(f"Vertex welding removed {total} vertices")
+
+        if self.cleanup_mesh:
+            totals = [0, 0]
+            for header, blobs in zip(headers, encoded):
+                stats = blobs.get('cleanup')
+                if not stats or not any(stats):
+                    continue
+                print(f"  {header['name']}: removed {stats[0]} triangles, {stats[1]} vertices")
+                totals = [a + b for a, b in zip(totals, stats)]
+            self.log(f"Mesh cleanup removed {totals[0]} triangles and {totals[1]} vertices")
+
+        if self.optimize_vcache:
+            # ACMR = vertex transforms per triangle (0.5 is the ideal for regular grids, 3.0 the worst)
+            totals = [0, 0, 0]
+            for header, blobs in zip(headers, encoded):
+                stats = blobs.get('vcache')
+                if not stats or not stats[0]:
+                    continue
+                num_tris, before, after = stats
+                print(f"  {header['name']}: ACMR {before / num_tris:.3f} -> {after / num_tris:.3f} ({num_tris} triangles)")
+                totals = [a + b for a, b in zip(totals, stats)]
+            if totals[0]:
+                self.log(f"Vertex cache ACMR (FIFO {ACMR_FIFO_SIZE}): {totals[1] / totals[0]:.3f} -> {totals[2] / totals[0]:.3f} over {totals[0]} triangles")
+
+        if self.bounds_mismatches:
+            self.log(f"Stored bbox props were stale on {len(self.bounds_mismatches)} frames, wrote the actual bounds")
+            for line in self.bounds_mismatches[:REPORT_LIST_LIMIT]:
+                self.log(f"  {line}")
+            if len(self.bounds_mismatches) > REPORT_LIST_LIMIT:
+                self.log(f"  ... and {len(self.bounds_mismatches) - REPORT_LIST_LIMIT} more")
+
+        clamped = [(header['name'], blobs['skin_clamped']) for header, blobs in zip(headers, encoded) if blobs.get('skin_clamped')]
+        if clamped:
+            for name, count in clamped:
+                print(f"  {name}: {count} vertices lost bone influences")
+            self.log(f"Clamped {sum(c for _, c in clamped)} skinned vertices to one bone or a bone and its parent")
+
+        self.log(f"Exported {total_frames} frames, {len(self.materials)} materials to {os.path.basename(self.filepath)}")
+        if self.use_cache:
+            self.log(f"Reused {self.cache_hits} unchanged frames from the export cache")
+        if self.generate_lods:
+            self.log(f"Generated {self.generated_lod_count} LOD levels")
+        if self.use_instancing:
+            self.log(f"Wrote {self.instance_count} frames as instances of earlier geometry")
+        if self.use_passthrough:
+            self.log(f"Copied {self.passthrough_count} untouched frames verbatim from their source files")
+        self.log(f"Peak temporary mesh memory: {self.peak_temp_mesh_bytes / (1024 * 1024):.2f} MB")
+
+class The5DSExporter:
+    """Writes the actions of objects and armature bones as a Mafia .5ds animation.
+
+    Animated frames are addressed by name: objects by their name, bones by the joint frame
+    names the .4ds exporter writes (the bone names).
+    """
+    VERSION = 20
+
+    def __init__(self, filepath, objects, frame_start, frame_end,
+                 position_tolerance=1e-3, rotation_tolerance=math.radians(0.1), scale_tolerance=1e-3):
+        self.filepath = filepath
+        self.objects = objects
+        self.frame_start = frame_start
+        self.frame_end = frame_end
+        self.position_tolerance = position_tolerance
+        self.rotation_tolerance = rotation_tolerance
+        self.scale_tolerance = scale_tolerance
+        self.report_lines = []
+
+    def log(self, message):
+        print(message)
+        self.report_lines.append(message)
+
+    def sample_channel(self, fcurves, data_path, size, default, frames):
+        """Values of one vector channel at every frame (None if the action does not animate it)."""
+        curves = [fc for fc in fcurves if fc.data_path == data_path and fc.array_index < size]
+        if not curves:
+            return None
+        values = np.tile(np.array(default, dtype=np.float64), (len(frames), 1))
+        for fc in curves:
+            values[:, fc.array_index] = self.sample_fcurve(fc, np.asarray(frames, dtype=np.float64))
+        return values
+
+    def sample_fcurve(self, fc, frames):
+        """One F-curve at all frames: constant/linear segments interpolated in bulk, only Bezier
+        (and other eased) segments, modifiers and linear extrapolation go through evaluate()."""
+        num_keys = len(fc.keyframe_points)
+        if not num_keys or fc.modifiers:
+            return np.array([fc.evaluate(frame) for frame in frames], dtype=np.float64)
+        keys = np.empty(num_keys * 2, dtype=np.float64)
+        fc.keyframe_points.foreach_get("co", keys)
+        key_frames, key_values = keys[0::2], keys[1::2]
+        interpolation = np.empty(num_keys, dtype=np.int32)
+        fc.keyframe_points.foreach_get("interpolation", interpolation)
+
+        # Segment of every frame (-1 before the first key, num_keys - 1 after the last)
+        segment = np.searchsorted(key_frames, frames, side='right') - 1
+        inner = (segment >= 0) & (segment < num_keys - 1)
+        # Outside the keys: constant extrapolation holds the end values
+        result = np.where(segment < 0, key_values[0], key_values[-1]).astype(np.float64)
+        seg = np.clip(segment, 0, max(num_keys - 2, 0))
+        kind = interpolation[seg]
+        constant = inner & (kind == KEY_CONSTANT)
+        result[constant] = key_values[seg[constant]]
+        linear = inner & (kind == KEY_LINEAR)
+        if linear.any():
+            span = np.maximum(key_frames[seg[linear] + 1] - key_frames[seg[linear]], 1e-12)
+            t = (frames[linear] - key_frames[seg[linear]]) / span
+            result[linear] = key_values[seg[linear]] + (key_values[seg[linear] + 1] - key_values[seg[linear]]) * t
+        # Frames exactly on a key take its value whatever the interpolation
+        on_key = inner & (frames == key_frames[seg])
+        result[on_key] = key_values[seg[on_key]]
+        slow = inner & ~constant & ~linear & ~on_key
+        if fc.extrapolation != 'CONSTANT':
+            slow |= ~inner
+        for i in np.flatnonzero(slow):
+            result[i] = fc.evaluate(frames[i])
+        return result
+
+    def sample_transforms(self, fcurves, prefix, rotation_mode, rest, frames):
+        """Local matrices (rest @ animated loc/rot/scale) per frame and which channels are animated."""
+        location = self.sample_channel(fcurves, prefix + "location", 3, (0.0, 0.0, 0.0), frames)
+        scale = self.sample_channel(fcurves, prefix + "scale", 3, (1.0, 1.0, 1.0), frames)
+        if rotation_mode == 'QUATERNION':
+            rotation = self.sample_channel(fcurves, prefix + "rotation_quaternion", 4, (1.0, 0.0, 0.0, 0.0), frames)
+            quats = [Quaternion(q) for q in rotation] if rotation is not None else None
+        elif rotation_mode == 'AXIS_ANGLE':
+            rotation = self.sample_channel(fcurves, prefix + "rotation_axis_angle", 4, (0.0, 0.0, 1.0, 0.0), frames)
+            quats = [Quaternion(r[1:], r[0]) for r in rotation] if rotation is not None else None
+        else:
+            rotation = self.sample_channel(fcurves, prefix + "rotation_euler", 3, (0.0, 0.0, 0.0), frames)
+            quats = [Euler(r, rotation_mode).to_quaternion() for r in rotation] if rotation is not None else None
+        flags = ((ANIM_ROTATION if rotation is not None else 0) | (ANIM_POSITION if location is not None else 0)
+                 | (ANIM_SCALE if scale is not None else 0))
+        matrices = []
+        for i in range(len(frames)):
+            basis = Matrix.LocRotScale(
+                Vector(location[i]) if location is not None else Vector((0.0, 0.0, 0.0)),
+                quats[i] if quats is not None else Quaternion(),
+                Vector(scale[i]) if scale is not None else Vector((1.0, 1.0, 1.0)))
+            matrices.append(rest @ basis)
+        return flags, matrices
+
+    def collect_tracks(self, frames):
+        """(name, flags, local matrices per frame) of every animated object and bone."""
+        tracks = []
+        for obj in self.objects:
+            action = obj.animation_data.action if obj.animation_data else None
+            slot = obj.animation_data.action_slot if action is not None else None
+            if slot is None:
+                continue
+            # Layered actions (Blender 4.4+): the object's F-curves live in its slot's channelbag
+            channelbag = action_get_channelbag_for_slot(action, slot)
+            if channelbag is None:
+                continue
+            fcurves = channelbag.fcurves
+            if obj.type == 'ARMATURE':
+                for bone in obj.data.bones:
+                    pose_bone = obj.pose.bones[bone.name]
+                    # Same space as the joint frame transform: relative to the parent bone's rest
+                    rest = bone.parent.matrix_local.inverted() @ bone.matrix_local if bone.parent else bone.matrix_local
+                    flags, matrices = self.sample_transforms(
+                        fcurves, f'pose.bones["{bone.name}"].', pose_bone.rotation_mode, rest, frames)
+                    if flags:
+                        tracks.append((bone.name, flags, matrices))
+            else:
+                # Same space as the .4ds frame header: relative to the parent object
+                rest = obj.matrix_parent_inverse if obj.parent else Matrix.Identity(4)
+                flags, matrices = self.sample_transforms(fcurves, "", obj.rotation_mode, rest, frames)
+                if flags:
+                    tracks.append((obj.name, flags, matrices))
+        return tracks
+
+    def encode_channel(self, f, frames, values, tolerance, key_errors):
+        """Key count, frame numbers (padded to 4 bytes) and the kept values of one channel."""
+        keep = reduce_keys(values, tolerance, key_errors)
+        f.write(struct.pack("<H", len(keep)))
+        f.write(np.asarray(frames, dtype="<u2")[keep].tobytes())
+        if len(keep) % 2 == 0:
+            f.write(struct.pack("<H", 0))
+        f.write(values[keep].astype("<f4").tobytes())
+        return len(keep)
+
+    def serialize_file(self):
+        frames = list(range(self.frame_start, self.frame_end + 1))
+        tracks = self.collect_tracks(frames)
+        if not tracks:
+            raise ExportError("No animated objects or bones found (actions are required)")
+        if len(frames) > 65535 or len(tracks) > 65535:
+            raise ExportError(f"{len(tracks)} animated frames over {len(frames)} frames exceed the 16-bit limits")
+        file_frames = [frame - self.frame_start for frame in frames]
+
+        data = io.BytesIO()
+        data.write(struct.pack("<2H", len(tracks), len(frames)))
+        table_start = data.tell()
+        data.write(b"\0" * (8 * len(tracks)))
+        data_offsets = []
+        samples = keys = 0
+        for name, flags, matrices in tracks:
+            data_offsets.append(data.tell())
+            data.write(struct.pack("<I", flags))
+            # File space: Y/Z swapped, quaternions stored w, x, y, z like the .4ds frame header
+            if flags & ANIM_ROTATION:
+                quats = np.array([m.to_quaternion()[:] for m in matrices], dtype=np.float64)[:, [0, 1, 3, 2]]
+                # Keep neighbouring keys in the same hemisphere so blending takes the short way
+                signs = np.cumprod(np.where((quats[1:] * quats[:-1]).sum(axis=1) < 0.0, -1.0, 1.0))
+                quats[1:] *= signs[:, None]
+                keys += self.encode_channel(data, file_frames, quats, self.rotation_tolerance, rotation_key_errors)
+                samples += len(frames)
+            if flags & ANIM_POSITION:
+                positions = np.array([m.to_translation()[:] for m in matrices], dtype=np.float64)[:, [0, 2, 1]]
+                keys += self.encode_channel(data, file_frames, positions, self.position_tolerance, linear_key_errors)
+                samples += len(frames)
+            if flags & ANIM_SCALE:
+                scales = np.array([m.to_scale()[:] for m in matrices], dtype=np.float64)[:, [0, 2, 1]]
+                keys += self.encode_channel(data, file_frames, scales, self.scale_tolerance, linear_key_errors)
+                samples += len(frames)
+        name_offsets = []
+        for name, _, _ in tracks:
+            name_offsets.append(data.tell())
+            data.write(name.encode("windows-1250", errors="replace") + b"\0")
+        data.seek(table_start)
+        for name_offset, data_offset in zip(name_offsets, data_offsets):
+            data.write(struct.pack("<2I", name_offset, data_offset))
+        blob = data.getvalue()
+
+        with open(self.filepath, "wb") as f:
+            f.write(b"5DS\0")
+            f.write(struct.pack("<H", self.VERSION))
+            f.write(struct.pack("<Q", filetime_now()))
+            f.write(struct.pack("<I", len(blob)))
+            f.write(blob)
+
+        self.log(f"Exported {len(tracks)} animated objects over {len(frames)} frames to {os.path.basename(self.filepath)}")
+        if samples:
+            self.log(f"Key reduction kept {keys} of {samples} sampled keys ({100.0 * keys / samples:.1f}%)")
+
 class The4DSPanelMaterial(bpy.types.Panel):
     bl_label = "4DS Material Properties"
     bl_idname = "MATERIAL_PT_4ds"
@@ -1313,6 +3806,7 @@ class The4DSImporter:
         self.armature = None
         self.parenting_info = []
         self.frame_types = {}
+        self.passthrough_frames = []
 
     def get_real_file_path(self, directory, filename):
         """Finds a file in a directory case-insensitively."""
@@ -1349,8 +3843,11 @@ class The4DSImporter:
             mat_count = struct.unpack("<H", f.read(2))[0]
             print(f"Reading {mat_count} materials...")
             self.materials = []
-            for _ in range(mat_count):
+            src = source_path(self.filepath)
+            for i in range(mat_count):
                 mat = self.deserialize_material(f)
+                mat["ls3d_src_file"] = src
+                mat["ls3d_src_index"] = i + 1
                 self.materials.append(mat)
             frame_count = struct.unpack("<H", f.read(2))[0]
             print(f"Reading {frame_count} frames...")
@@ -1368,10 +3865,25 @@ class The4DSImporter:
                     self.apply_skinning(mesh, vertex_groups, bone_to_parent)
             print("Applying parenting...")
             self.apply_deferred_parenting()
+            self.record_passthrough()
             is_animated = struct.unpack("<B", f.read(1))[0]
             if is_animated:
                 print("Animation data present (not supported)")
             print("Import completed.")
+    def record_passthrough(self):
+        """Stores source byte range + input hash on object/billboard frames so the exporter
+        can copy them verbatim while they stay untouched."""
+        src = source_path(self.filepath)
+        stamp = file_stamp(self.filepath)
+        for obj, visual_type, num_lods, start, end in self.passthrough_frames:
+            lods = [obj] + [bpy.data.objects.get(f"{obj.name}_lod{i}") for i in range(1, num_lods)]
+            if any(lod is None for lod in lods):
+                continue
+            obj["ls3d_src_file"] = src
+            obj["ls3d_src_range"] = [start, end]
+            obj["ls3d_src_stamp"] = stamp
+            obj["ls3d_src_hash"] = frame_input_hash(obj, lods, visual_type)
+
     def parent_to_bone(self, obj, bone_name):
         bpy.ops.object.select_all(action="DESELECT")
         self.armature.select_set(True)
@@ -2046,6 +4558,24 @@ class The4DSImporter:
     def deserialize_object(self, f, materials, mesh, mesh_data, culling_flags):
         instance_id = struct.unpack("<H", f.read(2))[0]
         if instance_id > 0:
+            # Instance: link the mesh data (and LODs) of the referenced frame
+            source = self.frames_map.get(instance_id)
+            if getattr(source, "type", None) == 'MESH':
+                mesh.data = source.data
+                bpy.data.meshes.remove(mesh_data)
+                mesh.ls3d_lod_dist = source.ls3d_lod_dist
+                for lod_idx in range(1, 10):
+                    source_lod = bpy.data.objects.get(f"{source.name}_lod{lod_idx}")
+                    if source_lod is None:
+                        break
+                    new_mesh = bpy.data.objects.new(f"{mesh.name}_lod{lod_idx}", source_lod.data)
+                    new_mesh.parent = mesh
+                    new_mesh.matrix_local = Matrix.Identity(4)
+                    bpy.context.collection.objects.link(new_mesh)
+                    new_mesh.ls3d_lod_dist = source_lod.ls3d_lod_dist
+                    new_mesh.cull_flags = culling_flags
+                    new_mesh.hide_set(True)
+                    new_mesh.hide_render = True
             return None, None
             
         vertices_per_lod = []
@@ -2246,6 +4776,7 @@ class The4DSImporter:
         user_props = self.read_string(f)
         
         self.frame_types[self.frame_index] = frame_type
+        body_start = f.tell()
         if parent_id > 0:
             self.parenting_info.append((self.frame_index, parent_id))
         
@@ -2264,7 +4795,9 @@ class The4DSImporter:
                 mesh.matrix_local = transform_mat
                 
                 mesh.cull_flags = culling_flags
-                self.deserialize_object(f, materials, mesh, mesh_data, culling_flags)
+                num_lods, _ = self.deserialize_object(f, materials, mesh, mesh_data, culling_flags)
+                if num_lods:
+                    self.passthrough_frames.append((mesh, visual_type, num_lods, body_start, f.tell()))
             
             elif visual_type == VISUAL_BILLBOARD:
                 mesh_data = bpy.data.meshes.new(name + "_mesh")
@@ -2277,8 +4810,10 @@ class The4DSImporter:
                 mesh.matrix_local = transform_mat
                 
                 mesh.cull_flags = culling_flags
-                self.deserialize_object(f, materials, mesh, mesh_data, culling_flags)
+                num_lods, _ = self.deserialize_object(f, materials, mesh, mesh_data, culling_flags)
                 self.deserialize_billboard(f, mesh)
+                if num_lods:
+                    self.passthrough_frames.append((mesh, visual_type, num_lods, body_start, f.tell()))
 
             elif visual_type == VISUAL_MIRROR:
                 mesh_data = bpy.data.meshes.new(name + "_mesh")
@@ -2435,11 +4970,115 @@ class Export4DS(bpy.types.Operator, ExportHelper):
     bl_label = "Export 4DS"
     filename_ext = ".4ds"
     filter_glob = StringProperty(default="*.4ds", options={"HIDDEN"})
+    threads: IntProperty(name="Encoding Threads", default=0, min=0, max=64, description="Worker threads that encode frames in parallel (0 = one per CPU core)")
+    use_cache: BoolProperty(name="Reuse Unchanged Frames", default=True, description="Only re-encode frames whose mesh, transform, flags or materials changed since the last export")
+    optimize_vcache: BoolProperty(name="Optimize Vertex Cache", default=False, description="Reorder triangles for GPU vertex cache reuse and report ACMR before/after (slower export)")
+    generate_lods: BoolProperty(name="Generate Missing LODs", default=False, description="Add decimated LOD levels to meshes without hand-made LODs")
+    lod_triangle_budget: IntProperty(name="LOD Triangle Budget", default=1000, min=0, description="Only meshes with more triangles get generated LODs")
+    lod_ratios: FloatVectorProperty(name="LOD Ratios", size=3, default=(0.5, 0.25, 0.1), min=0.0, max=1.0, description="Triangle ratio of each generated level relative to LOD0 (0 = skip level)")
+    lod_pixel_error: FloatProperty(name="LOD Pixel Error", default=1.0, min=0.01, description="Screen-space error (pixels) allowed when a LOD fades in")
+    lod_fov: FloatProperty(name="LOD Field of View", default=math.radians(60.0), min=math.radians(1.0), max=math.radians(170.0), subtype='ANGLE', description="Vertical camera field of view used for LOD distances")
+    lod_screen_height: IntProperty(name="LOD Screen Height", default=600, min=1, description="Vertical resolution (pixels) used for LOD distances")
+    compute_lod_distances: BoolProperty(name="Compute LOD Distances", default=False, description="Derive fade-in distances of LOD chains from their geometric error instead of the stored values")
+    cleanup_mesh: BoolProperty(name="Clean Up Meshes", default=False, description="Drop degenerate and duplicate triangles and unused vertices from the exported data (the Blender mesh is not changed)")
+    weld_vertices: BoolProperty(name="Weld Vertices", default=False, description="Merge exported vertices that only differ by float noise")
+    weld_distance: FloatProperty(name="Weld Distance", default=1e-4, min=0.0, precision=6, subtype='DISTANCE', description="Maximum position difference of welded vertices")
+    weld_uv_distance: FloatProperty(name="Weld UV Distance", default=1e-4, min=0.0, precision=6, description="Maximum UV difference of welded vertices")
+    weld_angle: FloatProperty(name="Weld Normal Angle", default=math.radians(5.0), min=0.0, max=math.pi, subtype='ANGLE', description="Maximum angle between normals of welded vertices")
+    dedup_materials: BoolProperty(name="Merge Duplicate Materials", default=True, description="Write materials with identical flags, colors and textures once and merge their face groups")
+    batch_static: BoolProperty(name="Batch Static Objects", default=False, description="Merge static visual objects without collision, user props or animation under each sector into one frame per render/cull flag combination")
+    atlas_textures: BoolProperty(name="Pack Texture Atlases", default=False, description="Pack small non-tiling diffuse textures into shared BMP atlases in the maps folder and merge their materials")
+    atlas_collection: StringProperty(name="Atlas Collection", default="", description="Only pack textures of objects in this collection (empty = all exported objects)")
+    atlas_size: IntProperty(name="Atlas Size", default=1024, min=64, max=4096, description="Width and height of each atlas in pixels")
+    atlas_max_texture: IntProperty(name="Max Packed Texture", default=256, min=1, max=2048, description="Larger textures stay separate")
+    use_instancing: BoolProperty(name="Instance Duplicate Meshes", default=True, description="Write objects with identical geometry as instances of the first occurrence")
+    use_passthrough: BoolProperty(name="Copy Untouched Frames", default=True, description="Copy object and billboard frames that were not edited since import verbatim from the original .4ds")
+    tile_mode: EnumProperty(
+        name="Split Into Chunks",
+        items=(
+            ('NONE', "Single File", "Write one .4ds"),
+            ('GRID', "Grid Tiles", "One .4ds per grid tile plus a shared base chunk and a .json manifest"),
+            ('SECTOR', "Per Sector", "One .4ds per root sector plus a shared base chunk and a .json manifest"),
+        ),
+        default='NONE'
+    )
+    tile_size: FloatProperty(name="Tile Size", default=100.0, min=1.0, subtype='DISTANCE', description="Edge length of a grid tile (X/Y)")
+
+    def exporter_options(self):
+        return dict(threads=self.threads, use_cache=self.use_cache, use_passthrough=self.use_passthrough, use_instancing=self.use_instancing, optimize_vcache=self.optimize_vcache,
+            generate_lods=self.generate_lods, lod_triangle_budget=self.lod_triangle_budget, lod_ratios=self.lod_ratios,
+            lod_pixel_error=self.lod_pixel_error, lod_fov=self.lod_fov, lod_screen_height=self.lod_screen_height,
+            compute_lod_distances=self.compute_lod_distances, cleanup_mesh=self.cleanup_mesh,
+            weld_vertices=self.weld_vertices, weld_distance=self.weld_distance,
+            weld_uv_distance=self.weld_uv_distance, weld_angle=self.weld_angle,
+            dedup_materials=self.dedup_materials, batch_static=self.batch_static,
+            atlas_textures=self.atlas_textures, atlas_collection=self.atlas_collection,
+            atlas_size=self.atlas_size, atlas_max_texture=self.atlas_max_texture)
+
+    def export_tiles(self, objects):
+        """One exporter run per chunk (each writes only the materials it uses), then the manifest.
+
+        The manifest is written last; if a chunk fails, the chunks written so far are removed.
+        """
+        # Target links are frame ids, which are only valid inside the file they were read from
+        linked = sorted(o.name for o in objects if o.type == 'EMPTY' and o.empty_display_type == 'PLAIN_AXES' and o.get("link_ids"))
+        if linked:
+            self.report({'ERROR'}, f"Targets with frame links cannot be split into chunks (frame ids are per file): {', '.join(linked)}")
+            return {"CANCELLED"}
+        chunks = partition_tiles([o for o in objects if not o.get("ls3d_no_export")], self.tile_mode, self.tile_size)
+        base_path = os.path.splitext(self.filepath)[0]
+        manifest = {'mode': self.tile_mode.lower(), 'tile_size': self.tile_size if self.tile_mode == 'GRID' else None, 'chunks': []}
+        frame_total = 0
+        written = []
+        report_lines = []
+        for key in sorted(chunks, key=lambda k: (k is not None, str(k))):
+            if key is None:
+                suffix = "base"
+            elif self.tile_mode == 'GRID':
+                suffix = f"x{key[0]}_y{key[1]}"
+            else:
+                suffix = bpy.path.clean_name(key)
+            path = f"{base_path}_{suffix}.4ds"
+            exporter = The4DSExporter(path, chunks[key], **self.exporter_options())
+            try:
+                exporter.serialize_file()
+            except ExportError as e:
+                for chunk_path in written:
+                    os.remove(chunk_path)
+                self.report({'ERROR'}, f"{os.path.basename(path)}: {e} (removed {len(written)} chunks already written, no manifest)")
+                return {"CANCELLED"}
+            written.append(path)
+            report_lines.extend(f"{os.path.basename(path)}: {line}" for line in exporter.report_lines)
+            bounds = world_bounds(chunks[key])
+            manifest['chunks'].append({
+                'file': os.path.basename(path),
+                'base': key is None,
+                # File space (Y up), like every position in the .4ds
+                'bounds_min': [float(bounds[0][0]), float(bounds[0][2]), float(bounds[0][1])],
+                'bounds_max': [float(bounds[1][0]), float(bounds[1][2]), float(bounds[1][1])],
+                'frames': exporter.frame_names,
+            })
+            frame_total += len(exporter.frame_names)
+        with open(base_path + ".json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        for line in report_lines:
+            self.report({'INFO'}, line)
+        self.report({'INFO'}, f"Exported {frame_total} frames into {len(manifest['chunks'])} chunks, manifest {os.path.basename(base_path)}.json")
+        return {"FINISHED"}
+
     def execute(self, context):
         # Use selected objects if any, otherwise all objects in scene
         objects = context.selected_objects if context.selected_objects else context.scene.objects
-        exporter = The4DSExporter(self.filepath, objects)
-        exporter.serialize_file()
+        if self.tile_mode != 'NONE':
+            return self.export_tiles(objects)
+        exporter = The4DSExporter(self.filepath, objects, **self.exporter_options())
+        try:
+            exporter.serialize_file()
+        except ExportError as e:
+            self.report({'ERROR'}, str(e))
+            return {"CANCELLED"}
+        for line in exporter.report_lines:
+            self.report({'INFO'}, line)
         return {"FINISHED"}
 class Import4DS(bpy.types.Operator, ImportHelper):
     bl_idname = "import_scene.4ds"
@@ -2451,11 +5090,34 @@ class Import4DS(bpy.types.Operator, ImportHelper):
         importer = The4DSImporter(self.filepath)
         importer.import_file()
         return {"FINISHED"}
+class Export5DS(bpy.types.Operator, ExportHelper):
+    bl_idname = "export_scene.5ds"
+    bl_label = "Export 5DS"
+    filename_ext = ".5ds"
+    filter_glob = StringProperty(default="*.5ds", options={"HIDDEN"})
+    position_tolerance: FloatProperty(name="Position Tolerance", default=1e-3, min=0.0, precision=5, subtype='DISTANCE', description="Largest position error allowed when dropping keys")
+    rotation_tolerance: FloatProperty(name="Rotation Tolerance", default=math.radians(0.1), min=0.0, subtype='ANGLE', description="Largest rotation error allowed when dropping keys")
+    scale_tolerance: FloatProperty(name="Scale Tolerance", default=1e-3, min=0.0, precision=5, description="Largest scale error allowed when dropping keys")
+    def execute(self, context):
+        # Use selected objects if any, otherwise all objects in scene
+        objects = context.selected_objects if context.selected_objects else context.scene.objects
+        exporter = The5DSExporter(self.filepath, objects, context.scene.frame_start, context.scene.frame_end,
+            position_tolerance=self.position_tolerance, rotation_tolerance=self.rotation_tolerance,
+            scale_tolerance=self.scale_tolerance)
+        try:
+            exporter.serialize_file()
+        except ExportError as e:
+            self.report({'ERROR'}, str(e))
+            return {"CANCELLED"}
+        for line in exporter.report_lines:
+            self.report({'INFO'}, line)
+        return {"FINISHED"}
 def menu_func_import(self, context):
     self.layout.operator(Import4DS.bl_idname, text="4DS Model File (.4ds)")
 
 def menu_func_export(self, context):
     self.layout.operator(Export4DS.bl_idname, text="4DS Model File (.4ds)")
+    self.layout.operator(Export5DS.bl_idname, text="5DS Animation File (.5ds)")
 
 # --- PROPERTY HELPER FUNCTIONS ---
 # These must exist before register() is called
@@ -2564,13 +5226,30 @@ def unregister():
     del bpy.types.Object.bbox_min
     del bpy.types.Object.bbox_max
 
-    # 3. Unregister Classes
+    # 3. Handlers
+    for handlers, func in (
+        (bpy.app.handlers.depsgraph_update_post, ls3d_depsgraph_update),
+        (bpy.app.handlers.undo_post, ls3d_clear_frame_cache),
+        (bpy.app.handlers.redo_post, ls3d_clear_frame_cache),
+        (bpy.app.handlers.load_post, ls3d_clear_frame_cache),
+    ):
+        if func in handlers:
+            handlers.remove(func)
+    ls3d_clear_frame_cache()
+
+    # 4. Unregister Classes
     bpy.utils.unregister_class(LS3D_OT_AddEnvSetup)
     bpy.utils.unregister_class(LS3D_OT_AddNode)
+    bpy.utils.unregister_class(LS3D_OT_ComputeLODDistances)
+    bpy.utils.unregister_class(LS3D_OT_GenerateSectors)
+    bpy.utils.unregister_class(LS3D_OT_AnalyzePVS)
+    bpy.utils.unregister_class(LS3D_OT_AssignSectors)
+    bpy.utils.unregister_class(LS3D_OT_GenerateOccluders)
     bpy.utils.unregister_class(The4DSPanelMaterial)
     bpy.utils.unregister_class(The4DSPanel)
     bpy.utils.unregister_class(Import4DS)
     bpy.utils.unregister_class(Export4DS)
+    bpy.utils.unregister_class(Export5DS)
 
 
 def register():
@@ -2693,10 +5372,16 @@ def register():
     # Classes
     bpy.utils.register_class(LS3D_OT_AddEnvSetup)
     bpy.utils.register_class(LS3D_OT_AddNode)
+    bpy.utils.register_class(LS3D_OT_ComputeLODDistances)
+    bpy.utils.register_class(LS3D_OT_GenerateSectors)
+    bpy.utils.register_class(LS3D_OT_AnalyzePVS)
+    bpy.utils.register_class(LS3D_OT_AssignSectors)
+    bpy.utils.register_class(LS3D_OT_GenerateOccluders)
     bpy.utils.register_class(The4DSPanelMaterial)
     bpy.utils.register_class(The4DSPanel)
     bpy.utils.register_class(Import4DS)
     bpy.utils.register_class(Export4DS)
+    bpy.utils.register_class(Export5DS)
     
     try:
         bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
@@ -2704,6 +5389,16 @@ def register():
     except: pass
     bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
     bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
+
+    # Dirty tracking for incremental export
+    for handlers, func in (
+        (bpy.app.handlers.depsgraph_update_post, ls3d_depsgraph_update),
+        (bpy.app.handlers.undo_post, ls3d_clear_frame_cache),
+        (bpy.app.handlers.redo_post, ls3d_clear_frame_cache),
+        (bpy.app.handlers.load_post, ls3d_clear_frame_cache),
+    ):
+        if func not in handlers:
+            handlers.append(func)
     
 if __name__ == "__main__":
     register()